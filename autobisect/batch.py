@@ -0,0 +1,275 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+from datetime import timedelta
+import hashlib
+import logging
+import os
+
+from .bisect import Bisector
+from .builds import BuildRange
+from .download import DownloadError
+
+log = logging.getLogger('batch')
+
+
+def collect_testcases(path):
+    """
+    Returns the testcases of a batch
+    :param path: A directory containing testcases or a file listing one testcase path per line
+    :return: A sorted list of absolute paths
+    """
+    if os.path.isdir(path):
+        testcases = [os.path.join(path, f) for f in os.listdir(path)
+                     if os.path.isfile(os.path.join(path, f)) and not f.startswith('.')]
+    else:
+        base = os.path.dirname(os.path.abspath(path))
+        with open(path) as f:
+            testcases = [os.path.join(base, os.path.expanduser(line.strip())) for line in f if line.strip()]
+    return sorted(set(os.path.abspath(t) for t in testcases))
+
+
+class Testcase(object):
+    """
+    A testcase of a batch
+    """
+    __slots__ = ('path', 'hash')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.hash = hashlib.sha1(f.read()).hexdigest()
+
+
+class Group(object):
+    """
+    Testcases which behaved identically on every build evaluated so far and share a build range
+    """
+    def __init__(self, testcases, start, end, phase, build_range=None):
+        self.testcases = testcases
+        self.start = start
+        self.end = end
+        self.phase = phase
+        self.build_range = build_range
+
+
+class BatchBisector(Bisector):
+    """
+    Bisects several testcases at once, evaluating each downloaded build against every unresolved testcase
+    Testcases start in a single group which is split whenever their results differ on a build
+    """
+    def __init__(self, evaluator, args, testcases):
+        """
+        :param evaluator: The evaluator, whose testcase is replaced before each evaluation
+        :param args: The parsed arguments
+        :param testcases: A list of testcase paths
+        """
+        self.testcases = [Testcase(path) for path in testcases]
+        evaluator.testcase = self.testcases[0].path
+        super(BatchBisector, self).__init__(evaluator, args)
+
+    def evaluate_all(self, build, testcases):
+        """
+        Evaluate several testcases against a build which is downloaded and verified at most once
+        :param build: An IndexedBuild object
+        :param testcases: A list of Testcase objects
+        :return: A list containing the status of each testcase
+        """
+        log.info('Testing build %s (%s) with %d testcases', build.changeset, build.build_id, len(testcases))
+        settings = self.evaluator.settings
+        statuses = [None] * len(testcases)
+        if self.use_cache:
+            for i, testcase in enumerate(testcases):
+                statuses[i] = self.build_manager.get_result(testcase.hash, build.changeset, settings)
+        pending = [i for i, status in enumerate(statuses) if status in (None, self.BUILD_FAILED)]
+        if not pending:
+            log.info('> Using previously recorded results')
+            return statuses
+
+        try:
+            with self.build_manager.get_build(build) as build_path:
+                verified = self.verify_build(build_path)
+                for i in pending:
+                    if verified:
+                        log.info('> Evaluating %s', os.path.basename(testcases[i].path))
+                        self.evaluator.testcase = testcases[i].path
+                        statuses[i] = self.evaluator.evaluate_testcase(build_path, verified=True)
+                    else:
+                        statuses[i] = self.BUILD_FAILED
+                    # Launch failures may be transient, the build is evaluated again by later bisections
+                    if statuses[i] != self.BUILD_FAILED:
+                        self.build_manager.store_result(testcases[i].hash, build.changeset, settings, statuses[i])
+        except DownloadError as e:
+            # Download failures are transient and must not be recorded as a result
+            log.error('Unable to retrieve build: %s', e)
+            for i in pending:
+                statuses[i] = self.BUILD_FAILED
+
+        return statuses
+
+    def verify_group(self):
+        """
+        Evaluate the boundaries with every testcase
+        :return: A Group object containing the testcases which behave as expected on both boundaries or None
+        """
+        log.info('Attempting to verify boundaries...')
+        expected = [(self.start, self.BUILD_CRASHED if self.find_fix else self.BUILD_PASSED),
+                    (self.end, self.BUILD_PASSED if self.find_fix else self.BUILD_CRASHED)]
+        testcases = self.testcases
+        for build, status in expected:
+            statuses = self.evaluate_all(build, testcases)
+            for testcase, result in zip(testcases, statuses):
+                if result != status:
+                    log.warning('Excluding %s which does not behave as expected on %s',
+                                testcase.path, build.changeset)
+            testcases = [t for t, result in zip(testcases, statuses) if result == status]
+            if not testcases:
+                return None
+
+        log.info('Verified boundaries for %d of %d testcases', len(testcases), len(self.testcases))
+        return Group(testcases, self.start, self.end, 'daily')
+
+    def enter_phase(self, group):
+        """
+        Create the build range of the current phase of a group
+        """
+        if group.phase == 'daily':
+            group.build_range = BuildRange.new(group.start.build_datetime + timedelta(days=1),
+                                               group.end.build_datetime - timedelta(days=1))
+            self.skip_unavailable(group.build_range)
+        else:
+            group.build_range = BuildRange(self.push_builds(group.start, group.end))
+
+    @staticmethod
+    def position(group, build):
+        """
+        Returns the position of a build within the range of a group or None if the range doesn't contain it
+        :param group: A Group object
+        :param build: An element of a build range, either a date string or an IndexedBuild object
+        """
+        try:
+            i = group.build_range.index(build)
+        except ValueError:
+            return None
+        # Skipped builds are no longer part of the range
+        return i if group.build_range.nearest(i) == i else None
+
+    def split(self, group, i, build, statuses):
+        """
+        Returns the groups replacing a group once a build of its range was evaluated
+        :param group: A Group object
+        :param i: The position of the build in the range of the group
+        :param build: The evaluated IndexedBuild object
+        :param statuses: The status of each testcase of the group
+        :return: A list of Group objects
+        """
+        build_range = group.build_range
+        # Statuses which move the start boundary forward and the end boundary backward respectively
+        if not self.find_fix:
+            advance, retreat = self.BUILD_PASSED, self.BUILD_CRASHED
+        else:
+            advance, retreat = self.BUILD_CRASHED, self.BUILD_PASSED
+
+        groups = []
+        for status in (advance, retreat, self.BUILD_FAILED):
+            testcases = [t for t, result in zip(group.testcases, statuses) if result == status]
+            if not testcases:
+                continue
+            if status == advance:
+                groups.append(Group(testcases, build, group.end, group.phase, build_range[i + 1:]))
+            elif status == retreat:
+                groups.append(Group(testcases, group.start, build, group.phase, build_range[:i]))
+            else:
+                # Other groups no longer include the build in their range
+                groups.append(Group(testcases, group.start, group.end, group.phase, build_range.skip(i)))
+
+        if len(groups) > 1:
+            log.info('Results diverged, splitting %d testcases into %d groups', len(group.testcases), len(groups))
+        return groups
+
+    def step(self, group, others):
+        """
+        Evaluate the build closest to the middle of the range of a group
+        The build is also evaluated with the testcases of every other group whose range contains it
+        :param group: The Group object to narrow
+        :param others: The other unresolved Group objects
+        :return: A list of the groups replacing the supplied groups
+        """
+        build_range = group.build_range
+        i, build = self.probe(build_range, build_range.width // 2)
+        if build is None:
+            return others + [group]
+
+        # Ranges in the same phase list the same kind of builds
+        element = build_range[i]
+        affected = [(group, i)]
+        remaining = []
+        for other in others:
+            pos = self.position(other, element) if other.phase == group.phase and other.build_range else None
+            if pos is not None:
+                affected.append((other, pos))
+            else:
+                remaining.append(other)
+        if len(affected) > 1:
+            log.info('Build is within the range of %d groups', len(affected))
+
+        statuses = self.evaluate_all(build, [t for g, _ in affected for t in g.testcases])
+        for g, pos in affected:
+            remaining.extend(self.split(g, pos, build, statuses[:len(g.testcases)]))
+            statuses = statuses[len(g.testcases):]
+        return remaining
+
+    def bisect(self):
+        """
+        Bisect all testcases
+        :return: A list of dicts describing the reduced build range of each group of testcases or None
+        """
+        log.info('Begin batch bisection of %d testcases...', len(self.testcases))
+        log.info('> Start: %s (%s)', self.start.changeset, self.start.build_id)
+        log.info('> End: %s (%s)', self.end.changeset, self.end.build_id)
+
+        group = self.verify_group()
+        if group is None:
+            log.critical('No testcase behaves as expected on the boundaries.  Cannot bisect!')
+            return None
+
+        self.enter_phase(group)
+        active = [group]
+        done = []
+        while active:
+            group = active.pop(0)
+            if not group.build_range:
+                if group.phase == 'daily':
+                    group.phase = 'push'
+                    self.enter_phase(group)
+                    active.append(group)
+                else:
+                    done.append(group)
+                continue
+            active = self.step(group, active)
+            self.build_manager.set_anchors(self.bisection_id, [b for g in active for b in (g.start, g.end)])
+        self.build_manager.set_anchors(self.bisection_id, [])
+
+        hits, misses = self.build_manager.cache_stats()
+        log.info('Build cache: %d hits, %d misses', hits, misses)
+
+        results = []
+        log.info('Reduced build ranges to:')
+        for group in sorted(done, key=lambda g: g.end.build_datetime):
+            pushlog = 'https://hg.mozilla.org/mozilla-%s/pushloghtml?fromchange=%s&tochange=%s' % (
+                self.branch, group.start.changeset, group.end.changeset)
+            log.info('> %s - %s: %s', group.start.changeset, group.end.changeset, pushlog)
+            for testcase in group.testcases:
+                log.info('>> %s', testcase.path)
+            results.append({
+                'testcases': [t.path for t in group.testcases],
+                'start': {'changeset': group.start.changeset, 'build_id': group.start.build_id},
+                'end': {'changeset': group.end.changeset, 'build_id': group.end.build_id},
+                'pushlog': pushlog,
+            })
+        return results
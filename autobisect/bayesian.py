@@ -0,0 +1,165 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import itertools
+import math
+
+# Probability of a build without the bug being reported as crashed
+FALSE_POSITIVE_RATE = 0.01
+# Probe positions considered when selecting several probes at once from a large range
+MAX_PROBE_CANDIDATES = 64
+# Largest probe set whose joint information gain is computed, the number of outcomes grows as 2^probes
+MAX_JOINT_PROBES = 6
+
+
+def _entropy(p):
+    """
+    Returns the entropy in bits of a Bernoulli distribution
+    """
+    if p <= 0 or p >= 1:
+        return 0.0
+    return -(p * math.log(p, 2) + (1 - p) * math.log(1 - p, 2))
+
+
+class Posterior(object):
+    """
+    Probability distribution over the position of the change between a list of candidate builds
+    Hypothesis h means that candidate h is the first build containing the change, with h == len(candidates)
+    meaning that the change was introduced by the end boundary
+    """
+    def __init__(self, count, false_negative, false_positive=FALSE_POSITIVE_RATE, find_fix=False):
+        """
+        :param count: The number of candidates between the boundaries
+        :param false_negative: Probability of a build with the bug being reported as passed
+        :param false_positive: Probability of a build without the bug being reported as crashed
+        :param find_fix: Whether the change removes the bug rather than introducing it
+        """
+        self.weights = [1.0 / (count + 1)] * (count + 1)
+        self.false_negative = false_negative
+        self.false_positive = false_positive
+        self.find_fix = find_fix
+
+    def __len__(self):
+        """
+        Returns the number of candidates
+        """
+        return len(self.weights) - 1
+
+    def crash_rate(self, changed):
+        """
+        Returns the probability of a build being reported as crashed
+        :param changed: Whether the build contains the change
+        """
+        if changed != self.find_fix:
+            return 1 - self.false_negative
+        return self.false_positive
+
+    def update(self, index, crashed):
+        """
+        Update the distribution with an evaluation result
+        :param index: The position of the evaluated candidate
+        :param crashed: Whether the evaluation reported a crash
+        """
+        for h in range(len(self.weights)):
+            p = self.crash_rate(index >= h)
+            self.weights[h] *= p if crashed else 1 - p
+        total = sum(self.weights)
+        self.weights = [w / total for w in self.weights]
+
+    def remove(self, index):
+        """
+        Remove a candidate which can't be evaluated
+        The change can no longer be located between this candidate and the next one
+        :param index: The position of the candidate
+        """
+        self.weights[index + 1] += self.weights[index]
+        del self.weights[index]
+
+    def most_likely(self):
+        """
+        Returns the most likely hypothesis and its probability
+        """
+        h = max(range(len(self.weights)), key=lambda i: self.weights[i])
+        return h, self.weights[h]
+
+    def information(self, probes):
+        """
+        Returns the expected information gain in bits of evaluating the supplied candidates
+        :param probes: A list of candidate positions
+        """
+        probes = sorted(probes)
+        # Hypotheses are only distinguished by how many of the probes precede them
+        groups = [0.0] * (len(probes) + 1)
+        g = 0
+        for h, w in enumerate(self.weights):
+            while g < len(probes) and probes[g] < h:
+                g += 1
+            groups[g] += w
+
+        # For hypotheses in group g, the probes before position g don't contain the change
+        rates = [[self.crash_rate(m >= g) for m in range(len(probes))] for g in range(len(groups))]
+
+        outcome_entropy = 0.0
+        for outcome in itertools.product((True, False), repeat=len(probes)):
+            p = 0.0
+            for w, group_rates in zip(groups, rates):
+                if w:
+                    likelihood = w
+                    for crashed, rate in zip(outcome, group_rates):
+                        likelihood *= rate if crashed else 1 - rate
+                    p += likelihood
+            if p > 0:
+                outcome_entropy -= p * math.log(p, 2)
+
+        noise = sum(w * sum(_entropy(rate) for rate in group_rates) for w, group_rates in zip(groups, rates))
+        return outcome_entropy - noise
+
+    def quantiles(self, count):
+        """
+        Returns the candidate positions splitting the distribution into count + 1 equally likely parts
+        :param count: The number of positions
+        :return: A sorted list of distinct candidate positions
+        """
+        cdf = []
+        total = 0.0
+        for w in self.weights:
+            total += w
+            cdf.append(total)
+        positions = set()
+        for k in range(1, count + 1):
+            q = float(k) / (count + 1)
+            positions.add(min(next((i for i, c in enumerate(cdf) if c >= q), len(self) - 1), len(self) - 1))
+        return sorted(positions)
+
+    def select(self, count, min_gain=1e-4):
+        """
+        Greedily select the candidates whose joint evaluation is expected to be the most informative
+        Larger selections than MAX_JOINT_PROBES are spread evenly over the distribution instead
+        :param count: The maximum number of candidates to select
+        :param min_gain: The minimum information gain in bits of an additional probe
+        :return: A list of candidate positions, possibly repeated
+        """
+        if not len(self):
+            return []
+        if count > MAX_JOINT_PROBES:
+            return self.quantiles(count)
+
+        positions = list(range(len(self)))
+        if len(positions) > MAX_PROBE_CANDIDATES and count > 1:
+            # Restrict the search to evenly spaced quantiles of the distribution
+            positions = self.quantiles(MAX_PROBE_CANDIDATES)
+
+        probes = []
+        current = 0.0
+        for _ in range(count):
+            gain, best = max((self.information(probes + [i]), i) for i in positions)
+            if gain - current < min_gain:
+                break
+            probes.append(best)
+            current = gain
+        return probes
@@ -7,19 +7,35 @@
 from __future__ import absolute_import
 
 from datetime import timedelta
+import hashlib
 import logging
+import math
+import multiprocessing
 import platform
+import threading
+import time
+import uuid
 
 from fuzzfetch import BuildFlags
-from fuzzfetch import Fetcher
-from fuzzfetch import FetcherException
 
+from .bayesian import FALSE_POSITIVE_RATE
+from .bayesian import Posterior
+from .build_index import BuildIndex
+from .build_index import FuzzFetchBackend
+from .build_index import IndexedBuild
 from .build_manager import BuildManager
 from .builds import BuildRange
 from .config import BisectionConfig
+from .download import DownloadError
+from .download import FULL_PROFILE
 
 log = logging.getLogger('bisect')
 
+# Number of launches used to measure the reproduction rate of intermittent testcases
+CALIBRATION_LAUNCHES = 10
+# Number of launches timed on the good boundary when learning the testcase timeout
+TIMING_LAUNCHES = 3
+
 
 class StatusError(Exception):
     """
@@ -28,6 +44,22 @@ class StatusError(Exception):
     pass
 
 
+class ResumeError(Exception):
+    """
+    Raised when an interrupted bisection can't be resumed
+    """
+    pass
+
+
+def _test_build_worker(task):
+    """
+    Evaluate a single build in a worker process
+    :param task: A tuple containing a Bisector object followed by the arguments of Bisector.test_build()
+    :return: The result of the build evaluation
+    """
+    return task[0].test_build(*task[1:])
+
+
 class Bisector(object):
     """
     Taskcluster Bisection Class
@@ -36,72 +68,253 @@ class Bisector(object):
     BUILD_PASSED = 1
     BUILD_FAILED = 2
 
-    def __init__(self, evaluator, args):
+    def __init__(self, evaluator, args, bisection_id=None):
         self.evaluator = evaluator
         self.target = args.target
         self.branch = args.branch
 
         self.find_fix = args.find_fix
+        self.prefetch = args.prefetch
+        self.jobs = args.jobs
+        self.engine = args.engine
+        self.auto_start = args.auto_start
+        self.confidence = args.confidence
+        self.false_negative = args.false_negative_rate
+        self.use_cache = not args.no_cache
 
         self.build_flags = BuildFlags(asan=args.asan, debug=args.debug, fuzzing=args.fuzzing, coverage=args.coverage)
         self.build_string = 'm-%s-%s%s' % (self.branch[0], platform.system().lower(), self.build_flags.build_string())
-        self.start = Fetcher(self.target, self.branch, args.start, self.build_flags)
-        self.end = Fetcher(self.target, self.branch, args.end, self.build_flags)
+        # Trimmed builds are stored separately from full builds
+        self.profile = getattr(evaluator, 'extraction_profile', FULL_PROFILE)
+        if self.profile.key:
+            self.build_string += '-%s' % self.profile.key
+
+        with open(self.evaluator.testcase, 'rb') as f:
+            self.testcase_hash = hashlib.sha1(f.read()).hexdigest()
 
         self.config = BisectionConfig(args.config)
-        self.build_manager = BuildManager(self.config, self.build_string)
+        self.build_manager = BuildManager.shared(self.config, self.build_string, self.profile)
+        self.build_manager.expire_results(self.config.result_ttl)
+        self.index = BuildIndex(self.build_manager.db, FuzzFetchBackend(self.target, self.branch, self.build_flags),
+                                self.config.index_ttl)
+
+        # Bisection state which is checkpointed after every step
+        self.phase = None
+        self.statuses = []
+        self._candidates = None
+        self._listings = {}
+        if args.resume is not None:
+            self.bisection_id = args.resume
+            state = self.build_manager.load_checkpoint(self.bisection_id)
+            if state is None:
+                raise ResumeError('No bisection found matching id %s' % self.bisection_id)
+            expected = {
+                'testcase': self.testcase_hash,
+                'find_fix': self.find_fix,
+                'target': self.target,
+                'branch': self.branch,
+                'flags': list(self.build_flags),
+                'engine': self.engine,
+            }
+            # Checkpoints saved by older versions don't record every argument
+            mismatched = sorted(key for key, value in expected.items() if state.get(key, value) != value)
+            if mismatched:
+                raise ResumeError('Testcase or arguments (%s) do not match bisection %s'
+                                  % (', '.join(mismatched), self.bisection_id))
+            self.phase = state['phase']
+            self.statuses = state['statuses']
+            self._candidates = state['candidates']
+            self.start = self.index.resolve(state['start'])
+            self.end = self.index.resolve(state['end'])
+            if state.get('repro_rate') is not None:
+                self.repro_rate = state['repro_rate']
+            if state.get('false_negative') is not None:
+                self.false_negative = state['false_negative']
+            if state.get('adapted_timeout') is not None:
+                self.evaluator.adapted_timeout = state['adapted_timeout']
+        else:
+            self.bisection_id = bisection_id or uuid.uuid4().hex[:12]
+            self.start = self.index.resolve(args.start)
+            self.end = self.index.resolve(args.end)
+
+        self._prefetch_threads = []
+        self._pool = None
+
+    def __getstate__(self):
+        # Fetcher objects, threads and sqlite3 connections can't be pickled
+        # Worker processes only need enough state to call test_build()
+        state = self.__dict__.copy()
+        for attr in ('start', 'end', 'build_manager', 'index', '_pool'):
+            state[attr] = None
+        state['_prefetch_threads'] = []
+        state['_backend'] = self.index.backend
+        return state
+
+    def __setstate__(self, state):
+        backend = state.pop('_backend')
+        self.__dict__.update(state)
+        self.build_manager = BuildManager.shared(self.config, self.build_string, self.profile)
+        self.index = BuildIndex(self.build_manager.db, backend, self.config.index_ttl)
 
     def bisect(self):
         """
         Main bisection function
+        :return: A dict describing the reduced build range or None if the boundaries couldn't be verified
         """
-        log.info('Begin bisection...')
+        log.info('Begin bisection (resume with --resume %s)...', self.bisection_id)
         log.info('> Start: %s (%s)', self.start.changeset, self.start.build_id)
         log.info('> End: %s (%s)', self.end.changeset, self.end.build_id)
 
-        if not self.verify_bounds():
-            log.critical('Unable to validate boundaries.  Cannot bisect!')
-            return
+        if self.phase is None:
+            if self.auto_start:
+                if not self.find_start():
+                    log.critical('Unable to find a start boundary.  Cannot bisect!')
+                    return None
+                log.info('> Start: %s (%s)', self.start.changeset, self.start.build_id)
+                log.info('> End: %s (%s)', self.end.changeset, self.end.build_id)
+                self.calibrate()
+            elif not self.verify_bounds():
+                log.critical('Unable to validate boundaries.  Cannot bisect!')
+                return None
+            self.phase = {'bayesian': 'bayesian', 'single-pass': 'single'}.get(self.engine, 'daily')
+        else:
+            log.info('Resuming %s phase with previously verified boundaries', self.phase)
+
+        if self.jobs > 1:
+            log.info('Evaluating up to %d builds concurrently', self.jobs)
+            self._pool = multiprocessing.Pool(self.jobs)
+
+        if self.phase == 'single':
+            log.info('Bisecting all available builds between the boundaries')
+            self.single_pass()
+            self.phase = 'done'
+            self.checkpoint(None)
 
-        # Initially reduce use 1 build per day for the entire build range
-        log.info('Attempting to reduce bisection range using taskcluster binaries')
-        build_range = BuildRange.new(
-            self.start.build_datetime + timedelta(days=1),
-            self.end.build_datetime - timedelta(days=1))
-
-        while build_range:
-            next_date = build_range.mid_point
-            i = build_range.index(next_date)
-
-            try:
-                next_build = Fetcher(self.target, self.branch, next_date, self.build_flags)
-            except FetcherException:
-                log.warning('Unable to find build for %s', next_date)
-                build_range.builds.pop(i)
+        if self.phase == 'bayesian':
+            log.info('Locating the most likely culprit with %.0f%% confidence', self.confidence * 100)
+            self.bayesian()
+            self.phase = 'done'
+            self.checkpoint(None)
+
+        if self.phase == 'daily':
+            # Initially reduce use 1 build per day for the entire build range
+            log.info('Attempting to reduce bisection range using taskcluster binaries')
+            if self._candidates is not None:
+                build_range = BuildRange(self._candidates)
             else:
-                status = self.test_build(next_build)
-                build_range = self.update_build_range(next_build, i, status, build_range)
+                build_range = BuildRange.new(
+                    self.start.build_datetime + timedelta(days=1),
+                    self.end.build_datetime - timedelta(days=1))
 
-        # Further reduce using all available builds associated with the start and end boundaries
-        builds = []
-        for dt in [self.start.build_datetime, self.end.build_datetime]:
-            for build in Fetcher.iterall(self.target, self.branch, dt.strftime('%Y-%m-%d'), self.build_flags):
-                # Only keep builds after the start and before the end boundaries
-                if self.end.build_datetime > build.build_datetime > self.start.build_datetime:
-                    builds.append(build)
+            self.skip_unavailable(build_range)
+            self.checkpoint(build_range)
+            while build_range:
+                if self._pool is not None:
+                    build_range = self.multisect(build_range)
+                else:
+                    i, next_build = self.probe(build_range, build_range.width // 2)
+                    if next_build is not None:
+                        self.prefetch_next(build_range, i)
+                        status = self.test_build(next_build)
+                        build_range = self.update_build_range(next_build, i, status, build_range)
+                self.checkpoint(build_range)
+
+            self.phase = 'push'
+            self._candidates = None
+
+        if self.phase == 'push':
+            # Further reduce using all available builds associated with the start and end boundaries
+            builds = self.push_builds()
+            if self._candidates is not None:
+                candidates = set(self._candidates)
+                builds = [build for build in builds if build.changeset in candidates]
+
+            build_range = BuildRange(builds)
+            self.checkpoint(build_range)
+            while build_range:
+                if self._pool is not None:
+                    build_range = self.multisect(build_range)
+                else:
+                    next_build = build_range.mid_point
+                    i = build_range.index(next_build)
+                    self.prefetch_next(build_range, i)
+                    status = self.test_build(next_build)
+                    build_range = self.update_build_range(next_build, i, status, build_range)
+                self.checkpoint(build_range)
+
+            self.phase = 'done'
+            self._candidates = None
+            self.checkpoint(None)
 
-        build_range = BuildRange(sorted(builds, key=lambda x: x.build_datetime))
-        while build_range:
-            next_build = build_range.mid_point
-            i = build_range.index(next_build)
-            status = self.test_build(next_build)
-            build_range = self.update_build_range(next_build, i, status, build_range)
+        self.wait_for_prefetch()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
 
+        hits, misses = self.build_manager.cache_stats()
+        log.info('Build cache: %d hits, %d misses', hits, misses)
+
+        pushlog = 'https://hg.mozilla.org/mozilla-%s/pushloghtml?fromchange=%s&tochange=%s' % (
+            self.branch, self.start.changeset, self.end.changeset)
         log.info('Reduced build range to:')
         log.info('> Start: %s (%s)', self.start.changeset, self.start.build_id)
         log.info('> End: %s (%s)', self.end.changeset, self.end.build_id)
-        log.info('> Pushlog: https://hg.mozilla.org/mozilla-%s/pushloghtml?fromchange=%s&tochange=%s',
-                 self.branch, self.start.changeset, self.end.changeset)
+        log.info('> Pushlog: %s', pushlog)
+
+        return {
+            'id': self.bisection_id,
+            'start': {'changeset': self.start.changeset, 'build_id': self.start.build_id},
+            'end': {'changeset': self.end.changeset, 'build_id': self.end.build_id},
+            'pushlog': pushlog,
+        }
+
+    def push_builds(self, start=None, end=None):
+        """
+        Retrieve all builds from the days of the start and end boundaries which fall between them
+        :param start: The start boundary, defaults to the current start boundary
+        :param end: The end boundary, defaults to the current end boundary
+        :return: A list of IndexedBuild objects sorted by build date
+        """
+        start = start if start is not None else self.start
+        end = end if end is not None else self.end
+        builds = []
+        dates = sorted(set(dt.strftime('%Y-%m-%d') for dt in [start.build_datetime, end.build_datetime]))
+        for date in dates:
+            for build in self.index.get_builds(date):
+                # Only keep builds after the start and before the end boundaries
+                if end.build_datetime > build.build_datetime > start.build_datetime:
+                    builds.append(build)
+
+        return sorted(builds, key=lambda x: x.build_datetime)
+
+    def checkpoint(self, build_range):
+        """
+        Save the current bisection state so that it can be resumed later
+        :param build_range: The current BuildRange object or None
+        """
+        candidates = []
+        if build_range is not None:
+            for build in build_range.builds:
+                candidates.append(build.changeset if isinstance(build, IndexedBuild) else build)
+
+        self.build_manager.set_anchors(self.bisection_id, [self.start, self.end] if self.phase != 'done' else [])
+        self.build_manager.save_checkpoint(self.bisection_id, {
+            'phase': self.phase,
+            'start': self.start.changeset,
+            'end': self.end.changeset,
+            'candidates': candidates,
+            'statuses': self.statuses,
+            'find_fix': self.find_fix,
+            'testcase': self.testcase_hash,
+            'target': self.target,
+            'branch': self.branch,
+            'flags': list(self.build_flags),
+            'engine': self.engine,
+            'repro_rate': self.repro_rate,
+            'false_negative': self.false_negative,
+            'adapted_timeout': getattr(self.evaluator, 'adapted_timeout', None),
+        })
 
     def update_build_range(self, build, index, status, build_range):
         """
@@ -112,6 +325,7 @@ class Bisector(object):
         :param build_range: The current BuildRange object
         :return: The adjusted BuildRange object
         """
+        self.statuses.append([build.changeset, status])
         if status == self.BUILD_PASSED:
             if not self.find_fix:
                 self.start = build
@@ -127,21 +341,403 @@ class Bisector(object):
             self.start = build
             return build_range[index + 1:]
         elif status == self.BUILD_FAILED:
-            build_range.builds.pop(index)
-            return build_range
+            return build_range.skip(index)
         else:
             raise StatusError('Invalid status supplied')
 
-    def test_build(self, build):
+    def multisect(self, build_range):
+        """
+        Split the build range into jobs + 1 segments and evaluate the split points concurrently
+        :param build_range: The current BuildRange object
+        :return: The adjusted BuildRange object
+        """
+        count = min(self.jobs, len(build_range))
+        # Split the window evenly, moving split points to the closest available builds
+        builds = {}
+        for k in range(count):
+            i, build = self.probe(build_range, (k + 1) * build_range.width // (count + 1), builds)
+            if build is not None:
+                builds[i] = build
+        builds = sorted(builds.items())
+        if not builds:
+            return build_range
+
+        for _, build in builds:
+            log.info('Queueing build %s (%s)', build.changeset, build.build_id)
+        statuses = self._pool.map(_test_build_worker, [(self, build) for _, build in builds])
+
+        return self.update_build_range_multi(builds, statuses, build_range)
+
+    def skip_unavailable(self, build_range):
+        """
+        Skip the days of a build range which are already known to have no builds
+        :param build_range: A BuildRange object containing date strings
+        """
+        missing = self.index.unavailable(build_range.builds)
+        for i in range(build_range.width):
+            if build_range[i] in missing:
+                build_range.skip(i)
+        if missing:
+            log.info('Skipping %d days without builds', len(missing))
+
+    def probe(self, build_range, center, exclude=()):
+        """
+        Returns the available build closest to the supplied position, probing neighbours alternately on either side
+        Days without builds are skipped from the build range and recorded in the build index
+        :param build_range: The current BuildRange object
+        :param center: The ideal position
+        :param exclude: Positions which must not be returned
+        :return: A tuple containing the position and the IndexedBuild object, or (None, None)
+        """
+        for i in build_range.outward(center):
+            if i in exclude:
+                continue
+            build = build_range[i]
+            if isinstance(build, IndexedBuild):
+                return i, build
+            indexed = self.index.find_build(build)
+            if indexed is not None:
+                return i, indexed
+            log.warning('Unable to find build for %s', build)
+            build_range.skip(i)
+        return None, None
+
+    def update_build_range_multi(self, builds, statuses, build_range):
+        """
+        Returns a new build range based on the statuses of several concurrently evaluated builds
+        :param builds: A list of (index, IndexedBuild) tuples sorted by index
+        :param statuses: The status of each evaluated build
+        :param build_range: The current BuildRange object
+        :return: The adjusted BuildRange object
+        """
+        indices = [i for i, _ in builds]
+        lower, upper, failed = self.update_bounds([build for _, build in builds], statuses)
+        lower = indices[lower] if lower >= 0 else -1
+        upper = indices[upper] if upper < len(indices) else build_range.width
+
+        for f in failed:
+            build_range = build_range.skip(indices[f])
+        return build_range[lower + 1:upper]
+
+    def update_bounds(self, builds, statuses):
+        """
+        Adjust the start and end boundaries based on the statuses of several evaluated builds
+        :param builds: A list of evaluated builds sorted by build date
+        :param statuses: The status of each evaluated build
+        :return: A tuple containing the position of the new start build (or -1), the position of the new end build
+                 (or len(builds)) and a list of the positions of failed builds
+        """
+        # Statuses which move the start boundary forward and the end boundary backward respectively
+        if not self.find_fix:
+            advance, retreat = self.BUILD_PASSED, self.BUILD_CRASHED
+        else:
+            advance, retreat = self.BUILD_CRASHED, self.BUILD_PASSED
+
+        lower, upper = -1, len(builds)
+        failed = []
+        for i, (build, status) in enumerate(zip(builds, statuses)):
+            self.statuses.append([build.changeset, status])
+            if status == self.BUILD_FAILED:
+                failed.append(i)
+            elif status == retreat:
+                if i < upper:
+                    self.end = build
+                    upper = i
+            elif status == advance:
+                if i > upper:
+                    log.warning('Build %s (%s) is inconsistent with earlier builds', build.changeset, build.build_id)
+                else:
+                    self.start = build
+                    lower = i
+            else:
+                raise StatusError('Invalid status supplied')
+
+        return lower, upper, failed
+
+    def single_pass(self):
+        """
+        Bisect all available builds between the start and end boundaries in a single pass
+        Days are only listed once the split point falls within them
+        """
+        skipped = set(changeset for changeset, status in self.statuses if status == self.BUILD_FAILED)
+        while True:
+            builds = self.split_points(self.jobs if self._pool is not None else 1, skipped)
+            if not builds:
+                break
+
+            if self._pool is not None:
+                for build in builds:
+                    log.info('Queueing build %s (%s)', build.changeset, build.build_id)
+                statuses = self._pool.map(_test_build_worker, [(self, build) for build in builds])
+            else:
+                statuses = [self.test_build(builds[0])]
+
+            _, _, failed = self.update_bounds(builds, statuses)
+            skipped.update(builds[i].changeset for i in failed)
+            self.checkpoint(None)
+
+    def split_points(self, count, skipped):
+        """
+        Select up to count builds which evenly split the builds between the start and end boundaries
+        :param count: The maximum number of builds to return
+        :param skipped: A set of changesets to exclude
+        :return: A list of IndexedBuild objects sorted by build date
+        """
+        first = self.start.build_datetime.date()
+        days = [(first + timedelta(days=offset)).strftime('%Y-%m-%d')
+                for offset in range((self.end.build_datetime.date() - first).days + 1)]
+
+        while True:
+            window = []
+            for date in days:
+                builds = self._listings.get(date)
+                if builds is not None:
+                    builds = [b for b in builds if b.changeset not in skipped
+                              and self.start.build_datetime < b.build_datetime < self.end.build_datetime]
+                window.append((date, builds))
+
+            # Days which haven't been listed yet are assumed to contain the average number of builds
+            known = [len(builds) for _, builds in window if builds is not None]
+            estimate = max(float(sum(known)) / len(known), 1.0) if known else 1.0
+            sizes = [len(builds) if builds is not None else estimate for _, builds in window]
+            total = sum(sizes)
+
+            selected = []
+            unlisted = None
+            for k in range(count):
+                target = total * (k + 1) / (count + 1)
+                offset = 0
+                for (date, builds), size in zip(window, sizes):
+                    if offset + size > target:
+                        if builds is None:
+                            unlisted = date
+                        elif builds[int(target - offset)] not in selected:
+                            selected.append(builds[int(target - offset)])
+                        break
+                    offset += size
+                if unlisted is not None:
+                    break
+
+            if unlisted is None:
+                return selected
+
+            log.debug('Listing builds for %s', unlisted)
+            self._listings[unlisted] = sorted(self.index.get_builds(unlisted), key=lambda x: x.build_datetime)
+
+    def bayesian(self):
+        """
+        Locate the most likely culprit while allowing for intermittent results
+        Daily builds are searched first, followed by the pushes surrounding the most likely day
+        """
+        if self.false_negative is None:
+            self.false_negative = self.estimate_false_negative_rate()
+        log.info('Assuming a false negative rate of %.2f', self.false_negative)
+
+        first = self.start.build_datetime.date()
+        dates = [(first + timedelta(days=offset)).strftime('%Y-%m-%d')
+                 for offset in range(1, (self.end.build_datetime.date() - first).days)]
+        self.start, self.end, day_probability = self.bayesian_search(dates, self.index.find_build)
+        self.checkpoint(None)
+
+        self.start, self.end, push_probability = self.bayesian_search(self.push_builds(), lambda build: build)
+        log.info('Most likely culprit: %s (%s) with probability %.2f',
+                 self.end.changeset, self.end.build_id, day_probability * push_probability)
+
+    def bayesian_search(self, candidates, resolve):
+        """
+        Maintain a probability distribution over the candidate containing the change and evaluate the most
+        informative candidates until the most likely one reaches the confidence threshold
+        :param candidates: A list of dates or builds between the start and end boundaries sorted by date
+        :param resolve: A callable returning the IndexedBuild of a candidate or None if it isn't available
+        :return: A tuple containing the builds surrounding the most likely change and its probability
+        """
+        candidates = list(candidates)
+        builds = [None] * len(candidates)
+        posterior = Posterior(len(candidates), self.false_negative, find_fix=self.find_fix)
+        evaluated = set()
+
+        def discard(i):
+            log.warning('Unable to evaluate candidate %s', candidates[i])
+            posterior.remove(i)
+            del candidates[i]
+            del builds[i]
+
+        while True:
+            h, probability = posterior.most_likely()
+            if probability >= self.confidence:
+                break
+            probes = posterior.select(self.jobs if self._pool is not None else 1)
+            if not probes:
+                log.warning('No remaining candidate is expected to be informative')
+                break
+
+            # Resolving in descending order keeps the positions of the remaining probes valid
+            unavailable = False
+            for i in sorted(set(probes), reverse=True):
+                if builds[i] is None:
+                    builds[i] = resolve(candidates[i])
+                    if builds[i] is None:
+                        discard(i)
+                        unavailable = True
+            if unavailable:
+                continue
+
+            # Repeated evaluations of a build are only informative if they are performed again
+            tasks = []
+            for i in probes:
+                fresh = builds[i].changeset in evaluated or any(task[1] == builds[i] for task in tasks)
+                tasks.append((self, builds[i], fresh))
+            if self._pool is not None:
+                statuses = self._pool.map(_test_build_worker, tasks)
+            else:
+                statuses = [self.test_build(*tasks[0][1:])]
+
+            failed = set()
+            for i, status in zip(probes, statuses):
+                self.statuses.append([builds[i].changeset, status])
+                evaluated.add(builds[i].changeset)
+                if status == self.BUILD_FAILED:
+                    failed.add(i)
+                else:
+                    posterior.update(i, status == self.BUILD_CRASHED)
+            for i in sorted(failed, reverse=True):
+                discard(i)
+            self.checkpoint(None)
+
+        # The builds surrounding the change, falling back to the next available candidate
+        h, probability = posterior.most_likely()
+        lower = upper = None
+        while lower is None and h > 0:
+            lower = builds[h - 1] or resolve(candidates[h - 1])
+            if lower is None:
+                discard(h - 1)
+                h -= 1
+        while upper is None and h < len(candidates):
+            upper = builds[h] or resolve(candidates[h])
+            if upper is None:
+                discard(h)
+        return lower or self.start, upper or self.end, probability
+
+    def estimate_false_negative_rate(self):
+        """
+        Estimate how often a build containing the bug is evaluated as passed
+        :return: A probability
+        """
+        sequential_test = getattr(self.evaluator, 'sequential_test', None)
+        if sequential_test is not None:
+            return sequential_test.beta
+
+        # Every repeat of an evaluation has to miss the bug
+        with self.build_manager.get_build(self.end if not self.find_fix else self.start) as build_path:
+            log.info('Measuring the reproduction rate over %d launches...', CALIBRATION_LAUNCHES)
+            results = self.evaluator.measure(build_path, CALIBRATION_LAUNCHES)
+        rate = (results.count(self.BUILD_CRASHED) + 1.0) / (len(results) + 2)
+        return max((1 - rate) ** self.evaluator.repeat, FALSE_POSITIVE_RATE)
+
+    def prefetch_next(self, build_range, index):
+        """
+        Download the builds that may be evaluated after the build at index in the background
+        :param build_range: The current BuildRange object
+        :param index: The index of the build currently being evaluated
+        """
+        if not self.prefetch:
+            return
+
+        self._prefetch_threads = [t for t in self._prefetch_threads if t.is_alive()]
+        for candidates in (build_range[:index], build_range[index + 1:]):
+            if candidates:
+                thread = threading.Thread(target=self._prefetch_build, args=(candidates.mid_point,))
+                thread.daemon = True
+                thread.start()
+                self._prefetch_threads.append(thread)
+
+    def _prefetch_build(self, build):
+        """
+        Download the supplied build into the build cache without evaluating it
+        :param build: A date string or an IndexedBuild object
+        """
+        try:
+            # The index is bound to the database connection of the thread which created it
+            if not isinstance(build, IndexedBuild):
+                index = BuildIndex(self.build_manager.db, self.index.backend, self.config.index_ttl)
+                build = index.find_build(build)
+                if build is None:
+                    return
+            with self.build_manager.get_build(build):
+                log.debug('Prefetched build %s (%s)', build.changeset, build.build_id)
+        except Exception as e:  # pylint: disable=broad-except
+            log.debug('Unable to prefetch build: %s', e)
+
+    def wait_for_prefetch(self):
+        """
+        Wait for outstanding background downloads so that no partially extracted build is left behind
+        """
+        pending = [t for t in self._prefetch_threads if t.is_alive()]
+        if pending:
+            log.info('Waiting for %d background download(s) to complete...', len(pending))
+            for thread in pending:
+                thread.join()
+        self._prefetch_threads = []
+
+    def test_build(self, build, fresh=False):
         """
         Prepare the build directory and launch the supplied build
         :param build: An Fetcher object to prevent duplicate fetching
+        :param fresh: Evaluate the build even if a result was previously recorded
         :return: The result of the build evaluation
         """
         log.info('Testing build %s (%s)', build.changeset, build.build_id)
+        settings = self.evaluator.settings
+        if self.use_cache and not fresh:
+            status = self.build_manager.get_result(self.testcase_hash, build.changeset, settings)
+            # Failures recorded by older versions may have been transient
+            if status is not None and status != self.BUILD_FAILED:
+                log.info('> Using previously recorded result')
+                return status
+
         # If persistence is enabled and a build exists, use it
-        with self.build_manager.get_build(build) as build_path:
-            return self.evaluator.evaluate_testcase(build_path)
+        try:
+            with self.build_manager.get_build(build) as build_path:
+                started = time.time()
+                status = self.evaluate(build_path)
+                duration = time.time() - started
+        except DownloadError as e:
+            # Download failures are transient and must not be recorded as a result
+            log.error('Unable to retrieve build: %s', e)
+            return self.BUILD_FAILED
+
+        log.debug('> Evaluation took %.1fs', duration)
+        self.build_manager.record_timing(self.testcase_hash, build.changeset, 'evaluation', duration)
+        # Launch failures may be transient, the build is evaluated again by later bisections
+        if status != self.BUILD_FAILED:
+            self.build_manager.store_result(self.testcase_hash, build.changeset, settings, status)
+        return status
+
+    def evaluate(self, build_path):
+        """
+        Evaluate the testcase against a stored build, skipping the launch verification if the build passed it before
+        :param build_path: Path to the build directory
+        :return: The result of the build evaluation
+        """
+        if not self.verify_build(build_path):
+            return self.BUILD_FAILED
+
+        return self.evaluator.evaluate_testcase(build_path, verified=True)
+
+    def verify_build(self, build_path):
+        """
+        Verify that a stored build launches, unless it passed verification before
+        :param build_path: Path to the build directory
+        :return: Boolean
+        """
+        startup_settings = self.evaluator.startup_settings
+        if self.use_cache and self.build_manager.is_verified(build_path, startup_settings):
+            log.info('> Build previously verified')
+        elif self.evaluator.verify(build_path):
+            self.build_manager.store_verified(build_path, startup_settings)
+        else:
+            return False
+        return True
 
     def verify_bounds(self):
         """
@@ -149,7 +745,25 @@ class Bisector(object):
         :return: Boolean
         """
         log.info('Attempting to verify boundaries...')
-        status = self.test_build(self.start)
+        # The sequential test verifying the bad bound relies on the reproduction rate
+        bad = self.measure_bad_bound()
+        if bad == self.BUILD_FAILED:
+            return False
+        if not self.verify_start(bad if self.find_fix else None) or not self.verify_end(None if self.find_fix else bad):
+            return False
+
+        log.info('Verified supplied boundaries!')
+        self.calibrate()
+        return True
+
+    def verify_start(self, status=None):
+        """
+        Verify that the start bound behaves as expected
+        :param status: The status of the bound if already known
+        :return: Boolean
+        """
+        if status is None:
+            status = self.test_build(self.start)
         if status == self.BUILD_FAILED:
             log.critical('Unable to launch the start build!')
             return False
@@ -159,8 +773,16 @@ class Bisector(object):
         elif status != self.BUILD_CRASHED and self.find_fix:
             log.critical("Start revision didn't crash!")
             return False
+        return True
 
-        status = self.test_build(self.end)
+    def verify_end(self, status=None):
+        """
+        Verify that the end bound behaves as expected
+        :param status: The status of the bound if already known
+        :return: Boolean
+        """
+        if status is None:
+            status = self.test_build(self.end)
         if status == self.BUILD_FAILED:
             log.critical('Unable to launch the end build!')
             return False
@@ -170,6 +792,121 @@ class Bisector(object):
         elif status == self.BUILD_CRASHED and self.find_fix:
             log.critical('End revision crashes!')
             return False
-
-        log.info('Verified supplied boundaries!')
         return True
+
+    def find_start(self):
+        """
+        Locate the start bound by evaluating builds 1, 2, 4, 8... days before the verified end bound
+        The supplied start bound is the earliest build considered
+        Builds behaving like the end bound are used as the new end bound
+        :return: Boolean
+        """
+        log.info('Searching for the start boundary...')
+        bad = self.measure_bad_bound() if not self.find_fix else None
+        if bad == self.BUILD_FAILED or not self.verify_end(bad):
+            return False
+
+        origin = self.end.build_datetime
+        limit = self.start
+        advance = self.BUILD_PASSED if not self.find_fix else self.BUILD_CRASHED
+        days = 1
+        while origin - timedelta(days=days) > limit.build_datetime:
+            date = (origin - timedelta(days=days)).strftime('%Y-%m-%d')
+            days *= 2
+            build = self.index.find_build(date)
+            if build is None:
+                log.warning('Unable to find build for %s', date)
+                continue
+
+            status = self.test_build(build)
+            self.statuses.append([build.changeset, status])
+            if status == advance:
+                self.start = build
+                log.info('Found start boundary %s (%s)', build.changeset, build.build_id)
+                return True
+            if status != self.BUILD_FAILED:
+                self.end = build
+
+        log.info('Falling back to the supplied start boundary')
+        return self.verify_start()
+
+    def measure_bad_bound(self):
+        """
+        Measure the reproduction rate on the bad bound before it is verified, unless it is known
+        A crash during the measurement verifies the bound as a fixed number of repeats would
+        :return: BUILD_CRASHED if a measured launch crashed, BUILD_FAILED if the build couldn't be retrieved,
+                 otherwise None
+        """
+        if self.repro_rate is not None or getattr(self.evaluator, 'sequential_test', None) is None:
+            return None
+        build = self.end if not self.find_fix else self.start
+        try:
+            results = self.measure_repro_rate(build)
+        except DownloadError as e:
+            log.critical('Unable to retrieve build %s: %s', build.changeset, e)
+            return self.BUILD_FAILED
+        return self.BUILD_CRASHED if self.BUILD_CRASHED in results else None
+
+    def calibrate(self):
+        """
+        Measure the properties of the testcase which depend on verified bounds
+        """
+        if self.repro_rate is None and getattr(self.evaluator, 'sequential_test', None) is not None:
+            self.measure_repro_rate(self.end if not self.find_fix else self.start)
+        if (getattr(self.evaluator, 'adaptive_timeout', None) is not None and
+                self.evaluator.adapted_timeout is None):
+            self.measure_timeout(self.start if not self.find_fix else self.end)
+
+    @property
+    def repro_rate(self):
+        """
+        Returns the reproduction rate used by the evaluator's sequential test or None if it is unknown
+        """
+        sequential_test = getattr(self.evaluator, 'sequential_test', None)
+        return sequential_test.repro_rate if sequential_test is not None else None
+
+    @repro_rate.setter
+    def repro_rate(self, rate):
+        sequential_test = getattr(self.evaluator, 'sequential_test', None)
+        if sequential_test is not None:
+            sequential_test.repro_rate = rate
+
+    def measure_repro_rate(self, build):
+        """
+        Estimate how often the testcase reproduces on a known bad build
+        :param build: The bad bound
+        :return: The list of launch statuses
+        """
+        log.info('Measuring the reproduction rate over %d launches...', CALIBRATION_LAUNCHES)
+        with self.build_manager.get_build(build) as build_path:
+            results = self.evaluator.measure(build_path, CALIBRATION_LAUNCHES)
+        # Laplace smoothing keeps the estimate away from 0 and 1
+        self.repro_rate = (results.count(self.BUILD_CRASHED) + 1.0) / (len(results) + 2)
+        log.info('Estimated reproduction rate: %.2f', self.repro_rate)
+        return results
+
+    def measure_timeout(self, build):
+        """
+        Learn the testcase timeout from the run time of the testcase on a known good build
+        The timeout is a multiple of the slowest launch, bounded by the configured floor and timeout
+        :param build: The good bound
+        """
+        multiplier, floor = self.evaluator.adaptive_timeout
+        configured = self.evaluator.timeout
+        log.info('Timing the testcase over %d launches...', TIMING_LAUNCHES)
+        durations = []
+        with self.build_manager.get_build(build) as build_path:
+            for _ in range(TIMING_LAUNCHES):
+                started = time.time()
+                self.evaluator.measure(build_path, 1)
+                duration = time.time() - started
+                durations.append(duration)
+                self.build_manager.record_timing(self.testcase_hash, build.changeset, 'baseline', duration)
+        log.info('Launch durations on the good build: %s', ', '.join('%.1fs' % d for d in durations))
+
+        # A launch cut short by the timeout says nothing about the actual run time
+        if max(durations) >= configured * 0.9:
+            log.warning('Testcase runs close to the configured timeout, keeping %ds', configured)
+            return
+        self.evaluator.adapted_timeout = int(math.ceil(min(max(multiplier * max(durations), floor), configured)))
+        log.info('Using a timeout of %ds', self.evaluator.adapted_timeout)
@@ -0,0 +1,308 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+from datetime import datetime
+from datetime import timedelta
+import json
+import logging
+import platform
+import time
+
+from fuzzfetch import BuildFlags
+from fuzzfetch import Fetcher
+from fuzzfetch import FetcherException
+from pytz import utc
+
+log = logging.getLogger('build-index')
+
+# Builds older than this are no longer expected to appear in or disappear from the remote index
+IMMUTABLE_AGE = timedelta(days=2)
+
+
+class IndexedBuild(object):
+    """
+    A build description stored in the build index which lazily resolves to a fuzzfetch.Fetcher
+    """
+    __slots__ = ('build_id', 'changeset', 'build_datetime', '_backend', '_fetcher')
+
+    def __init__(self, build_id, changeset, backend, fetcher=None):
+        self.build_id = build_id
+        self.changeset = changeset
+        self.build_datetime = utc.localize(datetime.strptime(build_id, '%Y%m%d%H%M%S'))
+        self._backend = backend
+        self._fetcher = fetcher
+
+    def __getstate__(self):
+        # fuzzfetch.Fetcher objects can't be pickled and are resolved again on demand
+        return self.build_id, self.changeset, self._backend
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __eq__(self, other):
+        return isinstance(other, IndexedBuild) and self.changeset == other.changeset
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.changeset)
+
+    def __repr__(self):
+        return 'IndexedBuild(%s, %s)' % (self.build_id, self.changeset)
+
+    @property
+    def fetcher(self):
+        """
+        Returns the fuzzfetch.Fetcher object for this build
+        """
+        if self._fetcher is None:
+            self._fetcher = self._backend.resolve(self.changeset)
+        return self._fetcher
+
+    @property
+    def target(self):
+        """
+        Returns the build target (firefox or js)
+        """
+        return self._backend.target
+
+    @property
+    def branch(self):
+        """
+        Returns the build branch (ex. central)
+        """
+        return self._backend.branch
+
+    @property
+    def flags(self):
+        """
+        Returns the fuzzfetch.BuildFlags of this build
+        """
+        return self._backend.flags
+
+    def artifact_url(self, suffix):
+        """
+        Returns the URL of the build artifact with the supplied suffix
+        :param suffix: The artifact suffix (ex. tar.bz2)
+        """
+        return self.fetcher.artifact_url(suffix)
+
+    def extract_build(self, path):
+        """
+        Download and extract the build
+        :param path: The destination path
+        """
+        self.fetcher.extract_build(path)
+
+
+class FuzzFetchBackend(object):
+    """
+    Build listing backend which queries taskcluster using fuzzfetch
+    """
+    def __init__(self, target, branch, flags):
+        self.target = target
+        self.branch = branch
+        self.flags = BuildFlags(*flags)
+
+    @property
+    def key(self):
+        """
+        Returns a string identifying the builds served by this backend
+        """
+        return '%s-%s-%s%s' % (self.target, self.branch, platform.system().lower(), self.flags.build_string())
+
+    def iterall(self, date):
+        """
+        Returns all builds available for the supplied date
+        :param date: A date string (YYYY-MM-DD)
+        :return: An iterable of fuzzfetch.Fetcher objects
+        """
+        return Fetcher.iterall(self.target, self.branch, date, self.flags)
+
+    def resolve(self, changeset):
+        """
+        Returns the build matching the supplied changeset or date
+        :param changeset: A full changeset or a date string (YYYY-MM-DD)
+        :return: A fuzzfetch.Fetcher object
+        """
+        return Fetcher(self.target, self.branch, changeset, self.flags)
+
+
+class StubBuild(object):
+    """
+    Build metadata served by StubBackend
+    Artifacts are expected at <url>/<changeset>.<suffix>, ex. a local HTTP server serving fixture archives
+    """
+    def __init__(self, build_id, changeset, url=None):
+        self.build_id = build_id
+        self.changeset = changeset
+        self.build_datetime = utc.localize(datetime.strptime(build_id, '%Y%m%d%H%M%S'))
+        self.url = url
+
+    def artifact_url(self, suffix):
+        """
+        Returns the URL of the build artifact with the supplied suffix
+        :param suffix: The artifact suffix (ex. tar.bz2)
+        """
+        return '%s/%s.%s' % (self.url, self.changeset, suffix)
+
+
+class StubBackend(object):
+    """
+    Offline build listing backend serving a fixed list of builds
+    Used to exercise the build index without network access
+    """
+    def __init__(self, builds, key='stub', target='firefox', flags=(False, False, False, False), branch='central'):
+        self.builds = sorted(builds, key=lambda b: b.build_id)
+        self.key = key
+        self.target = target
+        self.branch = branch
+        self.flags = BuildFlags(*flags)
+        self.requests = 0
+
+    def iterall(self, date):
+        """
+        Returns all builds available for the supplied date
+        :param date: A date string (YYYY-MM-DD)
+        :return: A list of StubBuild objects
+        """
+        self.requests += 1
+        return [b for b in self.builds if b.build_datetime.strftime('%Y-%m-%d') == date]
+
+    def resolve(self, changeset):
+        """
+        Returns the build matching the supplied changeset
+        :param changeset: A full changeset
+        :return: A StubBuild object
+        """
+        self.requests += 1
+        for build in self.builds:
+            if build.changeset == changeset:
+                return build
+        raise FetcherException('Unable to find build for %s' % changeset)
+
+
+class BuildIndex(object):
+    """
+    A persistent index of available builds per date stored in the build database
+    """
+    def __init__(self, db, backend, ttl):
+        """
+        :param db: A DatabaseManager object
+        :param backend: An object providing iterall(date) and resolve(changeset)
+        :param ttl: Number of seconds before listings of recent dates are refreshed
+        """
+        self.db = db
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def is_immutable(date):
+        """
+        Returns whether builds for the supplied date are no longer expected to change
+        :param date: A date string (YYYY-MM-DD)
+        """
+        return datetime.strptime(date, '%Y-%m-%d') < datetime.utcnow() - IMMUTABLE_AGE
+
+    def is_current(self, date, empty, updated):
+        """
+        Returns whether a recorded listing can still be used
+        fuzzfetch doesn't report failed requests when listing builds, so empty listings of immutable dates
+        also expire after the ttl rather than hiding the builds of that date for good
+        :param date: A date string (YYYY-MM-DD)
+        :param empty: Whether no builds were recorded
+        :param updated: The time the listing was recorded
+        """
+        return (self.is_immutable(date) and not empty) or time.time() - updated < self.ttl
+
+    def _lookup(self, date):
+        """
+        Returns the recorded builds for the supplied date if the record is still valid
+        :param date: A date string (YYYY-MM-DD)
+        :return: A list of IndexedBuild objects or None
+        """
+        res = self.db.cur.execute('SELECT builds, updated FROM build_index WHERE key = ? AND date = ?',
+                                  (self.backend.key, date))
+        row = res.fetchone()
+        if row is not None and self.is_current(date, row[0] == '[]', row[1]):
+            return [IndexedBuild(build_id, changeset, self.backend) for build_id, changeset in json.loads(row[0])]
+        return None
+
+    def get_builds(self, date):
+        """
+        Returns all builds available for the supplied date in the order listed by the backend
+        :param date: A date string (YYYY-MM-DD)
+        :return: A list of IndexedBuild objects
+        """
+        builds = self._lookup(date)
+        if builds is not None:
+            return builds
+
+        try:
+            builds = [IndexedBuild(b.build_id, b.changeset, self.backend, b) for b in self.backend.iterall(date)]
+        except FetcherException as e:
+            log.debug('Unable to list builds for %s: %s', date, e)
+            return []
+
+        self._record(date, builds)
+        return builds
+
+    def _record(self, date, builds):
+        self.db.cur.execute('INSERT OR REPLACE INTO build_index VALUES (?, ?, ?, ?)',
+                            (self.backend.key, date, json.dumps([[b.build_id, b.changeset] for b in builds]),
+                             time.time()))
+        self.db.con.commit()
+
+    def find_build(self, date):
+        """
+        Returns the build used to represent the supplied date
+        Only dates without builds are recorded as only the first available build is retrieved
+        :param date: A date string (YYYY-MM-DD)
+        :return: An IndexedBuild object or None
+        """
+        builds = self._lookup(date)
+        if builds is not None:
+            return builds[0] if builds else None
+
+        try:
+            for build in self.backend.iterall(date):
+                return IndexedBuild(build.build_id, build.changeset, self.backend, build)
+        except FetcherException as e:
+            log.debug('Unable to find build for %s: %s', date, e)
+            return None
+        self._record(date, [])
+        return None
+
+    def unavailable(self, dates):
+        """
+        Returns the dates which are known to have no builds using a single lookup
+        Dates which haven't been listed yet are assumed to be available
+        :param dates: A list of date strings (YYYY-MM-DD)
+        :return: A set of date strings
+        """
+        missing = set()
+        # Stay below the sqlite limit on the number of bound parameters
+        for offset in range(0, len(dates), 500):
+            chunk = dates[offset:offset + 500]
+            res = self.db.cur.execute('SELECT date, updated FROM build_index '
+                                      'WHERE key = ? AND builds = ? AND date IN (%s)' % ', '.join('?' * len(chunk)),
+                                      [self.backend.key, '[]'] + chunk)
+            for date, updated in res.fetchall():
+                if self.is_current(date, True, updated):
+                    missing.add(date)
+        return missing
+
+    def resolve(self, changeset):
+        """
+        Returns the build matching the supplied changeset
+        :param changeset: A full changeset
+        :return: An IndexedBuild object
+        """
+        build = self.backend.resolve(changeset)
+        return IndexedBuild(build.build_id, build.changeset, self.backend, build)
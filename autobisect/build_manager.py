@@ -4,14 +4,76 @@ from __future__ import absolute_import
 
 from collections import namedtuple
 from contextlib import contextmanager
+import errno
+import json
 import logging
 import os
+import re
 import shutil
+import socket
 import sqlite3
+import threading
 import time
 
+from .download import BuildDownloader
+from .download import FULL_PROFILE
+from .object_store import ObjectStore
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+    import msvcrt
+
 log = logging.getLogger('browser-bisect')
-Build = namedtuple('Build', ('path', 'stats'))
+Build = namedtuple('Build', ('path', 'size', 'last_access', 'access_count'))
+
+# Reservations (leases) of builds expire unless renewed by the holding process
+LEASE_DURATION = 300
+LEASE_TABLES = ('in_use', 'download_queue', 'anchors')
+
+# Heartbeat threads renewing the leases held by this process, keyed by (db_path, pid)
+_heartbeats = {}
+_heartbeats_lock = threading.Lock()
+
+# Temporary extraction directories and partial downloads are named after the build they belong to
+WORK_ENTRY = re.compile(r'^(.+-[0-9a-f]{40})\.')
+
+# Build managers shared by the threads of this process, keyed by configuration
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _pid_alive(pid):
+    """
+    Check whether a process with the supplied pid exists on this host
+    :param pid: A process id
+    :return: Boolean
+    """
+    if os.name != 'posix':
+        # os.kill() would terminate the process on Windows, rely on lease expiry instead
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _renew_leases(db_path, pid, host):
+    """
+    Periodically extend the leases held by the supplied process
+    :param db_path: Path to the sqlite3 database
+    :param pid: The process id holding the leases
+    :param host: The host name of the process holding the leases
+    """
+    db = DatabaseManager(db_path)
+    while True:
+        time.sleep(LEASE_DURATION / 5)
+        for table in LEASE_TABLES:
+            db.cur.execute('UPDATE %s SET expires = ? WHERE pid = ? AND host = ?' % table,
+                           (time.time() + LEASE_DURATION, pid, host))
+        db.con.commit()
 
 
 class DatabaseManager(object):
@@ -29,10 +91,50 @@ class DatabaseManager(object):
         :param db_path: Path to the sqlite3 database
         :type db_path: str
         """
-        self.con = sqlite3.connect(db_path)
+        # Multiple processes share the database: wait for locks instead of failing and let readers proceed
+        # while another connection is writing
+        self.con = sqlite3.connect(db_path, timeout=60)
         self.cur = self.con.cursor()
-        self.cur.execute('CREATE TABLE IF NOT EXISTS in_use (build_path, pid INT)')
-        self.cur.execute('CREATE TABLE IF NOT EXISTS download_queue (build_path TEXT primary key, pid INT)')
+        self.cur.execute('PRAGMA journal_mode=WAL')
+        self.cur.execute('PRAGMA busy_timeout=60000')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS in_use (build_path, pid INT, host TEXT, expires REAL)')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS download_queue '
+                         '(build_path TEXT primary key, pid INT, host TEXT, expires REAL)')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS results '
+                         '(testcase TEXT, changeset TEXT, build_string TEXT, settings TEXT, status INT, created REAL, '
+                         'PRIMARY KEY (testcase, changeset, build_string, settings))')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS checkpoints (id TEXT primary key, state TEXT, updated REAL)')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS builds '
+                         '(build_path TEXT primary key, size INT, created REAL, last_access REAL, access_count INT)')
+        if self.add_columns('builds', [('last_access', 'REAL'), ('access_count', 'INT')]):
+            self.cur.execute('UPDATE builds SET last_access = created, access_count = 0')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS anchors '
+                         '(build_path TEXT, pid INT, host TEXT, expires REAL, bisection TEXT)')
+        for table in LEASE_TABLES:
+            self.add_columns(table, [('host', 'TEXT'), ('expires', 'REAL')])
+        self.add_columns('anchors', [('bisection', 'TEXT')])
+        self.cur.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT primary key, value)')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS build_index '
+                         '(key TEXT, date TEXT, builds TEXT, updated REAL, PRIMARY KEY (key, date))')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS verified '
+                         '(build_path TEXT, settings TEXT, created REAL, PRIMARY KEY (build_path, settings))')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS timings '
+                         '(testcase TEXT, changeset TEXT, build_string TEXT, kind TEXT, duration REAL, created REAL)')
+
+    def add_columns(self, table, columns):
+        """
+        Add columns missing from tables created by older versions
+        :param table: The table name
+        :param columns: A list of (name, type) tuples
+        :return: True if any column was added
+        """
+        existing = [row[1] for row in self.cur.execute('PRAGMA table_info(%s)' % table).fetchall()]
+        added = False
+        for name, column_type in columns:
+            if name not in existing:
+                self.cur.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, name, column_type))
+                added = True
+        return added
 
     def close(self):
         """
@@ -46,111 +148,573 @@ class DatabaseManager(object):
         self.close()
 
 
+class EvictionPolicy(object):
+    """
+    Evicts the least recently used builds first
+    """
+    def order(self, builds, anchors):
+        """
+        Returns the supplied builds in the order they should be evicted
+        :param builds: A list of Build objects
+        :param anchors: A set of build paths used as boundaries by active bisections
+        :return: A list of Build objects
+        """
+        return sorted(builds, key=self.key)
+
+    @staticmethod
+    def key(build):
+        return build.last_access
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    Evicts the least frequently used builds first
+    """
+    @staticmethod
+    def key(build):
+        return build.access_count, build.last_access
+
+
+class SizeWeightedPolicy(EvictionPolicy):
+    """
+    Evicts large, rarely used builds first
+    """
+    @staticmethod
+    def key(build):
+        return -float(build.size) / (build.access_count + 1), build.last_access
+
+
+class AnchorPolicy(EvictionPolicy):
+    """
+    Evicts the least recently used builds first but never the boundaries of active bisections
+    """
+    def order(self, builds, anchors):
+        return [build for build in super(AnchorPolicy, self).order(builds, anchors) if build.path not in anchors]
+
+
+EVICTION_POLICIES = {
+    'anchors': AnchorPolicy,
+    'lfu': LFUPolicy,
+    'lru': EvictionPolicy,
+    'size': SizeWeightedPolicy,
+}
+
+
 class BuildManager(object):
     """
     A class for managing downloaded builds
     """
-    def __init__(self, config, build_string):
+    def __init__(self, config, build_string, profile=FULL_PROFILE):
         self.config = config
         self.build_prefix = build_string
 
         self.build_dir = os.path.join(self.config.store_path, 'builds')
         if not os.path.isdir(self.build_dir):
             os.makedirs(self.build_dir)
+        self.lock_dir = os.path.join(self.config.store_path, 'locks')
+        if not os.path.isdir(self.lock_dir):
+            os.makedirs(self.lock_dir)
+        # Builds are assembled outside of build_dir and renamed into place once complete
+        self.downloader = BuildDownloader(os.path.join(self.config.store_path, 'tmp'), self.config.download_retries,
+                                          profile)
+        # Optional store of files shared between builds
+        self.objects = None
+        if self.config.dedupe:
+            self.objects = ObjectStore(os.path.join(self.config.store_path, 'objects'))
 
         self.pid = os.getpid()
-        self.db = DatabaseManager(self.config.db_path)
+        self.host = socket.gethostname()
+        self._local = threading.local()
+        if self.config.eviction_policy not in EVICTION_POLICIES:
+            raise ValueError('Unknown eviction policy: %s' % self.config.eviction_policy)
+        self.policy = EVICTION_POLICIES[self.config.eviction_policy]()
+        self.reclaim_stale_leases()
+        self.reconcile_if_due()
+
+    @classmethod
+    def shared(cls, config, build_string, profile=FULL_PROFILE):
+        """
+        Returns a BuildManager shared by every thread of this process using the same configuration and builds
+        :param config: A BisectionConfig object
+        :param build_string: The build prefix
+        :param profile: The ExtractionProfile of the builds
+        """
+        key = (os.getpid(), json.dumps(vars(config), sort_keys=True), build_string, profile.key)
+        with _shared_lock:
+            if key not in _shared:
+                _shared[key] = cls(config, build_string, profile)
+            return _shared[key]
+
+    @property
+    def db(self):
+        """
+        Returns the database connection of the calling thread as sqlite3 connections can't be shared across threads
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = DatabaseManager(self.config.db_path)
+        return db
 
     @property
     def current_build_size(self):
+        """
+        Returns the total size of all stored builds as recorded in the database, and of the downloads in progress
+        """
+        res = self.db.cur.execute('SELECT COALESCE(SUM(size), 0) FROM builds')
+        total_size = res.fetchone()[0] + self.measure_build(self.downloader.work_dir)
+        # Deduplicated builds are recorded with the bytes they added to the object store
+        # Objects which outlive the build that added them are accounted for separately
+        res = self.db.cur.execute('SELECT value FROM metadata WHERE key = ?', ('shared_size',))
+        row = res.fetchone()
+        return total_size + (row[0] if row is not None else 0)
+
+    def adjust_shared_size(self, delta):
+        """
+        Update the number of stored object bytes which aren't attributed to a recorded build
+        :param delta: The change in bytes
+        """
+        self.db.cur.execute('INSERT OR IGNORE INTO metadata VALUES (?, 0)', ('shared_size',))
+        self.db.cur.execute('UPDATE metadata SET value = value + ? WHERE key = ?', (delta, 'shared_size'))
+
+    @staticmethod
+    def measure_build(build_path):
         """
         Recursively enumerate the size of the supplied build
+        :param build_path: Path to the build directory
         """
         total_size = 0
-        for dirpath, _, filenames in os.walk(self.build_dir):
+        for dirpath, _, filenames in os.walk(build_path):
             for f in filenames:
                 fp = os.path.join(dirpath, f)
                 try:
-                    total_size += os.path.getsize(fp)
+                    total_size += os.lstat(fp).st_size
                 except OSError:
                     log.debug('Directory became inaccessible while iterating: %s', fp)
 
         return total_size
 
+    def build_path(self, build):
+        """
+        Returns the path where the supplied build is stored
+        :param build: A fuzzFetch.Fetcher build object
+        """
+        return os.path.join(self.build_dir, '%s-%s' % (self.build_prefix, build.changeset))
+
+    def register_build(self, build_path, created=None):
+        """
+        Record the size of a newly extracted build, moving its files to the object store if enabled
+        :param build_path: Path to the build directory
+        :param created: Creation time of the build, defaults to now
+        """
+        if self.objects is not None:
+            with self.build_lock(self.objects.path):
+                size = self.objects.ingest(build_path)
+        else:
+            size = self.measure_build(build_path)
+        created = created or time.time()
+        self.db.cur.execute('INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?)',
+                            (build_path, size, created, created, 0))
+        # Verifications only apply to the extraction they were performed on
+        self.db.cur.execute('DELETE FROM verified WHERE build_path = ?', (build_path,))
+        self.db.con.commit()
+
+    def remove_build(self, build):
+        """
+        Remove a stored build from disk and from the database
+        :param build: A Build tuple
+        :return: The number of bytes freed
+        """
+        log.debug('Removing build: %s', build.path)
+        freed = build.size
+        if self.objects is not None and os.path.isdir(build.path):
+            # Objects still used by other builds remain stored once this build is gone
+            freed = self.objects.exclusive_size(build.path)
+            self.adjust_shared_size(build.size - freed)
+        if os.path.isdir(build.path):
+            shutil.rmtree(build.path)
+        self.db.cur.execute('DELETE FROM builds WHERE build_path = ?', (build.path,))
+        self.db.cur.execute('DELETE FROM verified WHERE build_path = ?', (build.path,))
+        return freed
+
+    def record_access(self, build_path, hit):
+        """
+        Record an access to a stored build
+        :param build_path: Path to the build directory
+        :param hit: Whether the build was available without downloading it
+        """
+        self.db.cur.execute('UPDATE builds SET last_access = ?, access_count = access_count + 1 WHERE build_path = ?',
+                            (time.time(), build_path))
+        counter = 'hits' if hit else 'misses'
+        self.db.cur.execute('INSERT OR IGNORE INTO metadata VALUES (?, 0)', (counter,))
+        self.db.cur.execute('UPDATE metadata SET value = value + 1 WHERE key = ?', (counter,))
+        self.db.con.commit()
+
+    def cache_stats(self):
+        """
+        Returns the number of build cache hits and misses
+        :return: A tuple containing the number of hits and misses
+        """
+        res = self.db.cur.execute('SELECT key, value FROM metadata WHERE key IN (?, ?)', ('hits', 'misses'))
+        stats = dict(res.fetchall())
+        return stats.get('hits', 0), stats.get('misses', 0)
+
+    def set_anchors(self, bisection_id, builds):
+        """
+        Record the boundaries of a bisection so that the anchors eviction policy keeps them
+        Anchors are leased by this process but replaced per bisection as a process may run several bisections
+        :param bisection_id: The id of the bisection
+        :param builds: A list of fuzzFetch.Fetcher build objects
+        """
+        self.start_heartbeat()
+        self.db.cur.execute('DELETE FROM anchors WHERE bisection = ?', (bisection_id,))
+        for build in builds:
+            self.db.cur.execute('INSERT INTO anchors (build_path, pid, host, expires, bisection) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (self.build_path(build), self.pid, self.host, time.time() + LEASE_DURATION,
+                                 bisection_id))
+        self.db.con.commit()
+
+    def acquire_lease(self, table, build_path):
+        """
+        Insert a lease on the supplied build which is renewed for as long as this process is alive
+        :param table: One of in_use, download_queue or anchors
+        :param build_path: Path to the build directory
+        """
+        self.start_heartbeat()
+        self.db.cur.execute('INSERT OR REPLACE INTO %s (build_path, pid, host, expires) VALUES (?, ?, ?, ?)' % table,
+                            (build_path, self.pid, self.host, time.time() + LEASE_DURATION))
+
+    def start_heartbeat(self):
+        """
+        Start renewing the leases held by this process if not done already
+        """
+        key = (self.config.db_path, self.pid)
+        with _heartbeats_lock:
+            thread = _heartbeats.get(key)
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=_renew_leases, args=(self.config.db_path, self.pid, self.host))
+                thread.daemon = True
+                thread.start()
+                _heartbeats[key] = thread
+
+    def reclaim_stale_leases(self):
+        """
+        Remove leases which have expired or which are held by processes on this host that no longer exist
+        """
+        now = time.time()
+        for table in LEASE_TABLES:
+            res = self.db.cur.execute('SELECT rowid, build_path, pid, host, expires FROM %s' % table)
+            for rowid, build_path, pid, host, expires in res.fetchall():
+                if (expires is not None and expires < now) or (host in (None, self.host) and not _pid_alive(pid)):
+                    log.debug('Reclaiming stale %s lease on %s held by pid %d', table, build_path, pid)
+                    self.db.cur.execute('DELETE FROM %s WHERE rowid = ?' % table, (rowid,))
+        self.db.con.commit()
+
+    def is_registered(self, build_path):
+        """
+        Check whether the supplied build was completely extracted
+        :param build_path: Path to the build directory
+        :return: Boolean
+        """
+        res = self.db.cur.execute('SELECT 1 FROM builds WHERE build_path = ?', (build_path,))
+        return res.fetchone() is not None
+
+    def reconcile(self):
+        """
+        Synchronize the recorded builds with the contents of the build directory
+        """
+        log.debug('Reconciling recorded build sizes')
+        res = self.db.cur.execute('SELECT 1 FROM metadata WHERE key = ?', ('last_reconcile',))
+        first_run = res.fetchone() is None
+        self.db.cur.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)', ('last_reconcile', time.time()))
+        self.db.con.commit()
+
+        on_disk = set(os.path.join(self.build_dir, build) for build in os.listdir(self.build_dir))
+        res = self.db.cur.execute('SELECT build_path FROM builds')
+        recorded = set(row[0] for row in res.fetchall())
+        res = self.db.cur.execute('SELECT build_path FROM download_queue')
+        downloading = set(row[0] for row in res.fetchall())
+
+        for build_path in recorded - on_disk:
+            self.db.cur.execute('DELETE FROM builds WHERE build_path = ?', (build_path,))
+        for build_path in on_disk - recorded - downloading:
+            if not first_run:
+                # Builds are recorded once extraction completes, anything else was left behind by a crashed process
+                with self.build_lock(build_path):
+                    if not self.is_registered(build_path) and os.path.isdir(build_path):
+                        log.warning('Removing partially extracted build: %s', build_path)
+                        shutil.rmtree(build_path)
+                continue
+            self.register_build(build_path, os.stat(build_path).st_mtime)
+        self.db.con.commit()
+
+        self.sweep_work_dir()
+
+        if self.objects is not None:
+            # Objects added by processes which crashed before registering their build were never accounted for
+            # and objects of builds removed behind our back are no longer attributed to them
+            with self.build_lock(self.objects.path):
+                self.objects.collect()
+                res = self.db.cur.execute('SELECT build_path, size FROM builds')
+                builds = res.fetchall()
+                used = self.objects.disk_usage([self.objects.path] + [build_path for build_path, _ in builds])
+                self.db.cur.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                                    ('shared_size', used - sum(size for _, size in builds)))
+                self.db.con.commit()
+
+    def sweep_work_dir(self):
+        """
+        Remove the temporary extraction directories and partial downloads left behind by crashed processes
+        :return: The number of bytes freed
+        """
+        res = self.db.cur.execute('SELECT build_path FROM download_queue')
+        downloading = set(os.path.basename(row[0]) for row in res.fetchall())
+        freed = 0
+        for entry in os.listdir(self.downloader.work_dir):
+            match = WORK_ENTRY.match(entry)
+            if match is None or match.group(1) in downloading:
+                continue
+            path = os.path.join(self.downloader.work_dir, entry)
+            # Downloads hold the lock of their build until their temporary files are removed
+            with self.build_lock(os.path.join(self.build_dir, match.group(1))):
+                if os.path.isdir(path):
+                    size = self.measure_build(path)
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    size = os.lstat(path).st_size
+                    os.remove(path)
+                else:
+                    continue
+            log.warning('Removed stale download: %s', path)
+            freed += size
+        return freed
+
+    def reconcile_if_due(self):
+        """
+        Reconcile the recorded builds if the configured interval has elapsed
+        """
+        res = self.db.cur.execute('SELECT value FROM metadata WHERE key = ?', ('last_reconcile',))
+        row = res.fetchone()
+        if row is None or time.time() - row[0] > self.config.reconcile_interval:
+            self.reconcile()
+
     def enumerate_builds(self):
         """
-        Enumerate all available builds including their size and stats
+        Enumerate all recorded builds in the order they should be evicted
         """
-        builds = []
-        for build in os.listdir(self.build_dir):
-            build_path = os.path.join(self.build_dir, build)
-            build_stats = os.stat(build_path)
-            builds.append(Build(build_path, build_stats))
+        res = self.db.cur.execute('SELECT build_path, size, last_access, access_count FROM builds')
+        builds = [Build(*row) for row in res.fetchall()]
+        res = self.db.cur.execute('SELECT build_path FROM anchors')
+        anchors = set(row[0] for row in res.fetchall())
 
-        return sorted(builds, key=lambda b: b.stats.st_atime)
+        return self.policy.order(builds, anchors)
 
     def remove_old_builds(self):
         """
         Removes stored builds to make room for newer builds
+        Builds which are anchored or in use are kept even if the limit is exceeded
         """
-        while self.current_build_size > self.config.persist_limit:
-            builds = self.enumerate_builds()
-            for build in builds:
-                if self.current_build_size < self.config.persist_limit:
-                    break
-
-                res = self.db.cur.execute('SELECT * FROM in_use, download_queue '
-                                          'WHERE in_use.build_path = ? OR download_queue.build_path = ?',
-                                          (build.path, build.path))
-                if res.fetchone() is None:
-                    log.debug('Removing build: %s', build.path)
-                    shutil.rmtree(build.path)
-                self.db.con.commit()
+        total_size = self.current_build_size
+        stalled = False
+        while total_size > self.config.persist_limit:
+            removed = False
+            # Hold the store lock so that no object gains a reference before unused objects are collected
+            with self.store_lock():
+                for build in self.enumerate_builds():
+                    if total_size < self.config.persist_limit:
+                        break
+
+                    res = self.db.cur.execute('SELECT 1 WHERE EXISTS (SELECT 1 FROM in_use WHERE build_path = ?) '
+                                              'OR EXISTS (SELECT 1 FROM download_queue WHERE build_path = ?)',
+                                              (build.path, build.path))
+                    if res.fetchone() is None:
+                        total_size -= self.remove_build(build)
+                        removed = True
+                    self.db.con.commit()
+
+                # A single pass over the store releases the objects of every removed build
+                if removed and self.objects is not None:
+                    self.objects.collect()
 
-            time.sleep(0.1)
+            if total_size > self.config.persist_limit:
+                # Give up once a pass following the reclaim of stale leases can't remove anything
+                if not removed and stalled:
+                    log.warning('Unable to free %d bytes, all remaining builds are anchored or in use',
+                                total_size - self.config.persist_limit)
+                    return
+                stalled = not removed
+                time.sleep(0.1)
+                self.reclaim_stale_leases()
+                total_size = self.current_build_size
+
+    def get_result(self, testcase, changeset, settings):
+        """
+        Retrieve a previously recorded evaluation result
+        :param testcase: A hash of the testcase content
+        :param changeset: The changeset of the evaluated build
+        :param settings: A string describing the evaluator settings
+        :return: The recorded status or None
+        """
+        res = self.db.cur.execute('SELECT status FROM results '
+                                  'WHERE testcase = ? AND changeset = ? AND build_string = ? AND settings = ?',
+                                  (testcase, changeset, self.build_prefix, settings))
+        row = res.fetchone()
+        return row[0] if row is not None else None
+
+    def store_result(self, testcase, changeset, settings, status):
+        """
+        Record the result of an evaluation
+        :param testcase: A hash of the testcase content
+        :param changeset: The changeset of the evaluated build
+        :param settings: A string describing the evaluator settings
+        :param status: The status of the evaluated testcase
+        """
+        self.db.cur.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                            (testcase, changeset, self.build_prefix, settings, status, time.time()))
+        self.db.con.commit()
+
+    def expire_results(self, max_age):
+        """
+        Remove recorded evaluation results and timings older than max_age
+        :param max_age: Maximum age in seconds
+        """
+        self.db.cur.execute('DELETE FROM results WHERE created < ?', (time.time() - max_age,))
+        self.db.cur.execute('DELETE FROM timings WHERE created < ?', (time.time() - max_age,))
+        self.db.con.commit()
+
+    def record_timing(self, testcase, changeset, kind, duration):
+        """
+        Record how long a launch of the testcase took
+        :param testcase: A hash of the testcase content
+        :param changeset: The changeset of the evaluated build
+        :param kind: 'baseline' for launches on the good boundary, 'evaluation' for complete build evaluations
+        :param duration: The wall-clock duration in seconds
+        """
+        self.db.cur.execute('INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?)',
+                            (testcase, changeset, self.build_prefix, kind, duration, time.time()))
+        self.db.con.commit()
+
+    def is_verified(self, build_path, settings):
+        """
+        Check whether the supplied build previously passed verification
+        :param build_path: Path to the build directory
+        :param settings: A string describing the evaluator settings which affect startup
+        :return: Boolean
+        """
+        res = self.db.cur.execute('SELECT 1 FROM verified WHERE build_path = ? AND settings = ?',
+                                  (build_path, settings))
+        return res.fetchone() is not None
+
+    def store_verified(self, build_path, settings):
+        """
+        Record that the supplied build passed verification
+        :param build_path: Path to the build directory
+        :param settings: A string describing the evaluator settings which affect startup
+        """
+        self.db.cur.execute('INSERT OR REPLACE INTO verified VALUES (?, ?, ?)', (build_path, settings, time.time()))
+        self.db.con.commit()
+
+    def save_checkpoint(self, bisection_id, state):
+        """
+        Record the state of a bisection
+        :param bisection_id: The identifier of the bisection
+        :param state: A JSON serializable dict describing the bisection state
+        """
+        self.db.cur.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)',
+                            (bisection_id, json.dumps(state), time.time()))
+        self.db.con.commit()
+
+    def load_checkpoint(self, bisection_id):
+        """
+        Retrieve the state of a bisection
+        :param bisection_id: The identifier of the bisection
+        :return: A dict describing the bisection state or None
+        """
+        res = self.db.cur.execute('SELECT state FROM checkpoints WHERE id = ?', (bisection_id,))
+        row = res.fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    @contextmanager
+    def build_lock(self, build_path):
+        """
+        Hold an exclusive advisory lock on the supplied build path
+        Blocks until the process or thread currently holding the lock releases it
+        :param build_path: Path to the build directory
+        """
+        lock_path = os.path.join(self.lock_dir, '%s.lock' % os.path.basename(build_path))
+        with open(lock_path, 'a') as lock_fp:
+            if fcntl is not None:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(lock_fp.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except IOError:
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_fp.fileno(), fcntl.LOCK_UN)
+                else:
+                    msvcrt.locking(lock_fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextmanager
+    def store_lock(self):
+        """
+        Hold the lock of the object store if builds are deduplicated
+        """
+        if self.objects is None:
+            yield
+        else:
+            with self.build_lock(self.objects.path):
+                yield
 
     @contextmanager
     def get_build(self, build):
         """
         Retrieve the build matching the supplied revision
-        :param build: A fuzzFetch.Fetcher build object
+        :param build: An IndexedBuild object
+        :raises DownloadError: If the build can't be retrieved
         """
-        target_path = os.path.join(self.build_dir, '%s-%s' % (self.build_prefix, build.changeset))
+        target_path = self.build_path(build)
+        hit = True
 
         try:
             # Insert build_path into in_use to prevent deletion
-            self.db.cur.execute('INSERT INTO in_use VALUES (?, ?)', (target_path, self.pid))
+            self.db.cur.execute('INSERT INTO in_use (build_path, pid, host, expires) VALUES (?, ?, ?, ?)',
+                                (target_path, self.pid, self.host, time.time() + LEASE_DURATION))
             self.db.con.commit()
+            self.start_heartbeat()
+
+            # Only one process downloads a build at a time
+            # Others block on the lock until the download completes
+            with self.build_lock(target_path):
+                # A build which exists on disk but was never recorded was left behind by a crashed process
+                if os.path.isdir(target_path) and not self.is_registered(target_path):
+                    log.warning('Removing partially extracted build: %s', target_path)
+                    shutil.rmtree(target_path)
 
-            # Try to insert the build_path into download_queue
-            # If the insert fails, another process is already downloading it
-            # Poll the database until it complete
-            try:
-                self.db.cur.execute('INSERT into download_queue VALUES (?, ?)', (target_path, self.pid))
-                self.db.con.commit()
                 # If the build doesn't exist on disk, download it
                 if not os.path.isdir(target_path):
-                    self.remove_old_builds()
-                    while True:
-                        # Hackish - FuzzFetch can fail when downloading - try until success
-                        try:
-                            build.extract_build(target_path)
-                            break
-                        except Exception:  # ToDo: Add the correct exception to catch
-                            pass
-            except sqlite3.IntegrityError:
-                while True:
-                    res = self.db.cur.execute('SELECT * FROM download_queue WHERE build_path = ?', (target_path,))
-                    if res.fetchone() is None:
-                        break
-                    else:
-                        time.sleep(0.1)
-            finally:
-                self.db.cur.execute('DELETE FROM download_queue WHERE build_path = ? AND pid = ?',
-                                    (target_path, self.pid))
-                self.db.con.commit()
+                    hit = False
+                    self.acquire_lease('download_queue', target_path)
+                    self.db.con.commit()
+                    try:
+                        self.remove_old_builds()
+                        self.downloader.fetch(build, target_path)
+                        self.register_build(target_path)
+                    finally:
+                        self.db.cur.execute('DELETE FROM download_queue WHERE build_path = ? AND pid = ? AND host = ?',
+                                            (target_path, self.pid, self.host))
+                        self.db.con.commit()
 
+            self.record_access(target_path, hit)
             yield target_path
         finally:
-            self.db.cur.execute('DELETE FROM in_use WHERE build_path = ? AND pid = ?', (target_path, self.pid))
+            # Only release a single reservation as other threads of this process may hold the same build
+            self.db.cur.execute('DELETE FROM in_use WHERE rowid = '
+                                '(SELECT rowid FROM in_use WHERE build_path = ? AND pid = ? AND host = ? LIMIT 1)',
+                                (target_path, self.pid, self.host))
             self.db.con.commit()
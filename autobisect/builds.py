@@ -8,51 +8,129 @@
 
 from __future__ import absolute_import, division, print_function  # isort:skip
 
-import copy
 from datetime import timedelta
 import logging
 
 log = logging.getLogger('builds')
 
 
+def _build_key(build):
+    """
+    Returns the value identifying a build within a sequence, the changeset of builds or the date string itself
+    """
+    return getattr(build, 'changeset', build)
+
+
 class BuildRange(object):
     """
-    A class for storing a range of builds or build representations
+    A window over a sorted sequence of builds or build representations
+    Narrowed ranges share the underlying sequence so that slicing doesn't copy it
+    Positions are relative to the window and include skipped builds
+    Skipping a build excludes it from every window over the same sequence
     """
+    __slots__ = ('_builds', '_positions', '_skipped', '_lo', '_hi')
+
     def __init__(self, builds):
-        self._builds = builds
+        """
+        :param builds: A sequence of builds sorted by date
+        """
+        self._builds = tuple(builds)
+        self._positions = dict((_build_key(b), pos) for pos, b in enumerate(self._builds))
+        # Flags marking unavailable builds
+        self._skipped = bytearray(len(self._builds))
+        self._lo = 0
+        self._hi = len(self._builds)
+
+    def _view(self, lo, hi):
+        view = BuildRange.__new__(BuildRange)
+        view._builds = self._builds
+        view._positions = self._positions
+        view._skipped = self._skipped
+        view._lo = lo
+        view._hi = hi
+        return view
+
+    def _is_skipped(self, pos):
+        return self._skipped[pos] != 0
 
     def __len__(self):
-        return len(self._builds)
+        """
+        Returns the number of available builds
+        """
+        return self._hi - self._lo - self._skipped.count(b'\x01', self._lo, self._hi)
 
-    def __getslice__(self, smin, smax):
-        new_range = copy.copy(self)
-        new_range._builds = self._builds[smin:smax]
-        return new_range
+    def __iter__(self):
+        for pos in range(self._lo, self._hi):
+            if not self._is_skipped(pos):
+                yield self._builds[pos]
 
     def __getitem__(self, i):
-        return self._builds[i].build_info
+        if isinstance(i, slice):
+            if i.step not in (None, 1):
+                raise ValueError('BuildRange slices do not support steps')
+            start, stop, _ = i.indices(self.width)
+            return self._view(self._lo + start, self._lo + max(start, stop))
+        if i < 0:
+            i += self.width
+        if not 0 <= i < self.width:
+            raise IndexError('BuildRange index out of range')
+        return self._builds[self._lo + i]
+
+    @property
+    def width(self):
+        """
+        Returns the number of positions in the window, including skipped builds
+        """
+        return self._hi - self._lo
 
     @property
     def builds(self):
         """
-        Returns the "builds" list
+        Returns a list of the available builds
         """
-        return self._builds
+        return list(self)
 
     @property
     def mid_point(self):
         """
-        Returns the midpoint of the "builds" list
+        Returns the available build closest to the middle of the window
+        """
+        i = self.nearest(self.width // 2)
+        return self[i] if i is not None else None
+
+    def nearest(self, i):
+        """
+        Returns the position of the available build closest to position i or None if all builds were skipped
         """
-        return self._builds[len(self) // 2]
+        return next(self.outward(i), None)
+
+    def outward(self, i):
+        """
+        Yields the positions of available builds alternating either side of position i, starting with the closest
+        Builds skipped while iterating are not yielded
+        """
+        for offset in range(max(i + 1, self.width - i)):
+            for pos in (i - offset, i + offset) if offset else (i,):
+                if 0 <= pos < self.width and not self._is_skipped(self._lo + pos):
+                    yield pos
 
     def index(self, build):
         """
-        Returns the index of the provided build
-        :param build: An object within the "builds" list
+        Returns the position of the provided build
+        :param build: An object within the window, or the changeset of a build within the window
+        """
+        pos = self._positions.get(_build_key(build))
+        if pos is None or not self._lo <= pos < self._hi:
+            raise ValueError('%r is not in range' % (build,))
+        return pos - self._lo
+
+    def skip(self, i):
+        """
+        Exclude the build at position i, which is unavailable, from every window over the sequence
+        :return: The BuildRange object
         """
-        return self.builds.index(build)
+        self._skipped[self._lo + i] = 1
+        return self
 
     @classmethod
     def new(cls, start, end):
@@ -17,6 +17,18 @@ storage-path: %s
 persist: true
 ; size in MBs
 persist-limit: 30000
+; lifetime of cached evaluation results in days
+result-ttl: 30
+; minutes before build listings of recent days or days without builds are refreshed
+index-ttl: 60
+; hours between checks of the recorded build sizes against the build directory
+reconcile-interval: 24
+; build eviction policy (lru, lfu, size or anchors)
+eviction-policy: lru
+; failed download attempts tolerated per build artifact
+download-retries: 5
+; share identical files between stored builds using hardlinks
+dedupe: false
 """ % CONFIG_DIR
 
 
@@ -45,6 +57,12 @@ class BisectionConfig(object):
             persist_limit = config_obj.getint('autobisect', 'persist-limit') * 1024 * 1024
             self.persist_limit = persist_limit if self.persist else 0
             self.store_path = config_obj.get('autobisect', 'storage-path')
+            self.result_ttl = config_obj.getint('autobisect', 'result-ttl', fallback=30) * 24 * 60 * 60
+            self.index_ttl = config_obj.getint('autobisect', 'index-ttl', fallback=60) * 60
+            self.reconcile_interval = config_obj.getint('autobisect', 'reconcile-interval', fallback=24) * 60 * 60
+            self.eviction_policy = config_obj.get('autobisect', 'eviction-policy', fallback='lru')
+            self.download_retries = config_obj.getint('autobisect', 'download-retries', fallback=5)
+            self.dedupe = config_obj.getboolean('autobisect', 'dedupe', fallback=False)
         except configparser.NoOptionError as e:
             log.critical('Unable to parse configuration file: %s', e.message)
             raise
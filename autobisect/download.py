@@ -0,0 +1,439 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import configparser
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import stat
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+
+from fuzzfetch import FetcherException
+import requests
+
+log = logging.getLogger('download')
+
+CHUNK_SIZE = 1024 * 1024
+# Seconds to wait for the server before a transfer is considered stalled
+REQUEST_TIMEOUT = 60
+# Delay before the first retry, doubled after each failed attempt
+BACKOFF_BASE = 2
+BACKOFF_MAX = 120
+
+HTTP_SESSION = requests.Session()
+
+
+class DownloadError(Exception):
+    """
+    Raised when a build can't be retrieved within the configured number of attempts
+    """
+    pass
+
+
+class Transfer(object):
+    """
+    A resumable HTTP transfer into a partial file which may be consumed while it is being written
+    """
+    def __init__(self, url, part_path, retries):
+        """
+        :param url: The artifact URL
+        :param part_path: Path of the partial file, an existing file is resumed
+        :param retries: Number of failed attempts tolerated before giving up
+        """
+        self.url = url
+        self.part_path = part_path
+        self.retries = retries
+        self.done = False
+        self.error = None
+        self.cancelled = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _notify(self, **kwargs):
+        with self._cond:
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+            self._cond.notify_all()
+
+    def _attempt(self):
+        """
+        Fetch the remainder of the artifact, appending to the partial file
+        """
+        offset = os.path.getsize(self.part_path) if os.path.isfile(self.part_path) else 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        resp = HTTP_SESSION.get(self.url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+        try:
+            if offset and resp.status_code == 416:
+                # The partial file is already complete
+                return
+            resp.raise_for_status()
+
+            # Servers which don't support range requests resend the whole artifact
+            skip = offset if resp.status_code == 200 else 0
+            expected = resp.headers.get('Content-Length')
+            expected = int(expected) - skip if expected is not None else None
+
+            received = 0
+            with open(self.part_path, 'ab') as out:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    if self.cancelled:
+                        raise DownloadError('Transfer cancelled')
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    if chunk:
+                        out.write(chunk)
+                        out.flush()
+                        received += len(chunk)
+                        self._notify()
+
+            if expected is not None and received < expected:
+                raise IOError('Connection closed after %d of %d bytes' % (received, expected))
+        finally:
+            resp.close()
+
+    def run(self):
+        """
+        Download the artifact, resuming after failures with exponential backoff
+        """
+        failures = 0
+        while True:
+            try:
+                self._attempt()
+                self._notify(done=True)
+                return
+            except DownloadError as e:
+                self._notify(error=e)
+                return
+            except (requests.exceptions.RequestException, IOError) as e:
+                failures += 1
+                if self.cancelled or failures > self.retries:
+                    self._notify(error=DownloadError('Unable to download %s: %s' % (self.url, e)))
+                    return
+                delay = min(BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX)
+                log.warning('Download of %s failed (%s), retrying in %ds (%d/%d)',
+                            self.url, e, delay, failures, self.retries)
+                time.sleep(delay)
+
+    def start(self):
+        """
+        Run the transfer in a background thread
+        """
+        if not os.path.isfile(self.part_path):
+            open(self.part_path, 'wb').close()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self):
+        """
+        Stop the background transfer
+        """
+        self.cancelled = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self):
+        """
+        Block until the transfer completes
+        """
+        with self._cond:
+            while not (self.done or self.error):
+                self._cond.wait(1)
+            if self.error:
+                raise self.error
+
+    def reader(self):
+        """
+        Returns a file object reading the artifact while it is being downloaded
+        """
+        return _FollowingReader(self)
+
+
+class _FollowingReader(object):
+    """
+    Read-only file object which blocks for data not yet written by a Transfer
+    """
+    def __init__(self, transfer):
+        self._transfer = transfer
+        self._fp = open(transfer.part_path, 'rb')
+
+    def read(self, size=-1):
+        while True:
+            data = self._fp.read(size)
+            if data or size == 0:
+                return data
+            with self._transfer._cond:
+                if self._transfer.error:
+                    raise self._transfer.error
+                if self._transfer.done:
+                    return self._fp.read(size)
+                self._transfer._cond.wait(1)
+
+    def close(self):
+        self._fp.close()
+
+
+def _extract_file(zip_fp, info, path):
+    """
+    Extract a zip member while preserving its permissions
+    """
+    zip_fp.extract(info.filename, path=path)
+    out_path = os.path.join(path, info.filename)
+    os.chmod(out_path, (info.external_attr >> 16) | stat.S_IREAD)
+
+
+def _safe_member(member, path):
+    """
+    Returns whether the tar member stays within the extraction path
+    """
+    dest = os.path.realpath(os.path.join(path, member.name))
+    return dest == os.path.realpath(path) or dest.startswith(os.path.realpath(path) + os.sep)
+
+
+class ExtractionProfile(object):
+    """
+    Selects the build files kept during extraction
+    Patterns are matched against paths relative to the build directory (ex. 'symbols/*')
+    """
+    def __init__(self, name, include=('*',), exclude=()):
+        self.name = name
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+
+    @property
+    def key(self):
+        """
+        Returns a string identifying the builds produced by this profile, empty for full builds
+        """
+        if self.include == ('*',) and not self.exclude:
+            return ''
+        digest = hashlib.sha1(json.dumps([self.include, self.exclude]).encode('utf-8')).hexdigest()
+        return '%s.%s' % (self.name, digest[:8])
+
+    def matches(self, path):
+        """
+        Returns whether the supplied file should be extracted
+        :param path: A path relative to the build directory
+        """
+        path = path.replace(os.sep, '/')
+        return (any(fnmatch.fnmatch(path, p) for p in self.include) and
+                not any(fnmatch.fnmatch(path, p) for p in self.exclude))
+
+    def prune(self, build_path):
+        """
+        Remove files which don't match the profile from an already extracted build
+        :param build_path: Path to the build directory
+        """
+        for dirpath, _, filenames in os.walk(build_path):
+            for f in filenames:
+                fp = os.path.join(dirpath, f)
+                if not self.matches(os.path.relpath(fp, build_path)):
+                    os.unlink(fp)
+
+
+FULL_PROFILE = ExtractionProfile('full')
+
+
+class BuildDownloader(object):
+    """
+    Downloads build artifacts and extracts them into the build directory
+    Archives are extracted while downloading where the format allows it and builds are only
+    moved into place once complete
+    """
+    def __init__(self, work_dir, retries, profile=FULL_PROFILE):
+        """
+        :param work_dir: Directory for partial downloads and extractions, on the same filesystem as the builds
+        :param retries: Number of failed attempts tolerated per artifact
+        :param profile: The ExtractionProfile applied to downloaded archives
+        """
+        self.work_dir = work_dir
+        self.retries = retries
+        self.profile = profile
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+
+    def _transfer(self, build, suffix, name):
+        part_path = os.path.join(self.work_dir, '%s.%s.part' % (name, suffix))
+        return Transfer(build.artifact_url(suffix), part_path, self.retries)
+
+    def extract_tar(self, build, path, name):
+        """
+        Stream a .tar.bz2 artifact into path, stripping the top-level "firefox" directory
+        :param build: The build to retrieve
+        :param path: The extraction path
+        :param name: Name used for the partial download
+        """
+        transfer = self._transfer(build, 'tar.bz2', name)
+        log.info('> Downloading and extracting archive: %s ..', transfer.url)
+        transfer.start()
+        reader = transfer.reader()
+        try:
+            with tarfile.open(fileobj=reader, mode='r|bz2') as tar:
+                for member in tar:
+                    if not member.name.startswith('firefox/'):
+                        continue
+                    member.name = member.name[8:]
+                    if not member.isdir() and not self.profile.matches(member.name):
+                        continue
+                    if not _safe_member(member, path):
+                        raise DownloadError('Refusing to extract %s outside of the build directory' % member.name)
+                    tar.extract(member, path)
+            # Ensure the tail of the transfer was received successfully
+            transfer.wait()
+        except Exception as e:
+            transfer.cancel()
+            # Keep partial transfers for resumption unless the archive itself is broken
+            if not isinstance(e, DownloadError):
+                os.unlink(transfer.part_path)
+            raise
+        finally:
+            reader.close()
+        os.unlink(transfer.part_path)
+
+    def extract_zip(self, build, suffix, path, name, prefix=''):
+        """
+        Download a zip artifact and extract it into path
+        The central directory is stored at the end of zip files so these can't be streamed
+        :param build: The build to retrieve
+        :param suffix: The artifact suffix
+        :param path: The extraction path
+        :param name: Name used for the partial download
+        :param prefix: Location of path relative to the build directory
+        """
+        transfer = self._transfer(build, suffix, name)
+        log.info('> Downloading and extracting archive: %s ..', transfer.url)
+        transfer.start()
+        transfer.wait()
+        try:
+            with zipfile.ZipFile(transfer.part_path) as zip_fp:
+                for info in zip_fp.infolist():
+                    if info.filename.endswith('/') or self.profile.matches(prefix + info.filename):
+                        _extract_file(zip_fp, info, path)
+        finally:
+            os.unlink(transfer.part_path)
+
+    def _extract(self, build, path, name):
+        """
+        Retrieve all artifacts of the supplied build into path
+        """
+        if build.target == 'js':
+            self.extract_zip(build, 'jsshell.zip', path, name)
+        else:
+            self.extract_tar(build, path, name)
+
+        if build.flags.coverage:
+            self.extract_zip(build, 'code-coverage-gcno.zip', path, name)
+        # Skip the symbols artifact entirely when the profile excludes it
+        if not (build.flags.asan or build.flags.coverage) and self.profile.matches('symbols/'):
+            os.mkdir(os.path.join(path, 'symbols'))
+            self.extract_zip(build, 'crashreporter-symbols.zip', os.path.join(path, 'symbols'), name, 'symbols/')
+
+        # Match the layout produced by fuzzfetch
+        os.mkdir(os.path.join(path, 'dist'))
+        os.symlink(os.pardir, os.path.join(path, 'dist', 'bin'))
+        self.write_fuzzmanagerconf(build, path, name)
+
+    def write_fuzzmanagerconf(self, build, path, name):
+        """
+        Write the FuzzManager configuration of the build using the same fields as fuzzfetch
+        :param build: The build to retrieve
+        :param path: The build directory
+        :param name: Name used for the partial download
+        """
+        transfer = self._transfer(build, 'mozinfo.json', name)
+        transfer.start()
+        try:
+            transfer.wait()
+            with open(transfer.part_path) as f:
+                moz_info = json.load(f)
+        except ValueError as e:
+            raise DownloadError('Invalid mozinfo.json for build %s: %s' % (build.changeset, e))
+        finally:
+            os.unlink(transfer.part_path)
+
+        output = configparser.RawConfigParser()
+        output.add_section('Main')
+        output.set('Main', 'platform', moz_info['processor'].replace('_', '-'))
+        output.set('Main', 'product', 'mozilla-' + build.branch)
+        output.set('Main', 'product_version', '%.8s-%.12s' % (build.build_id, build.changeset))
+        output.set('Main', 'os', moz_info['os'])
+        output.add_section('Metadata')
+        output.set('Metadata', 'pathPrefix', moz_info['topsrcdir'])
+        output.set('Metadata', 'buildFlags', '')
+        with open(os.path.join(path, '%s.fuzzmanagerconf' % build.target), 'w') as conf_fp:
+            output.write(conf_fp)
+
+    def _stream(self, build, path, name):
+        """
+        Retrieve all artifacts of the supplied build into path, starting over with backoff if extraction fails
+        Interrupted transfers are retried by Transfer, this covers corrupt archives and unresolvable builds
+        """
+        failures = 0
+        while True:
+            try:
+                self._extract(build, path, name)
+                return
+            except (tarfile.TarError, zipfile.BadZipfile, FetcherException, EnvironmentError) as e:
+                failures += 1
+                if failures > self.retries:
+                    raise DownloadError('Unable to retrieve build %s: %s' % (build.changeset, e))
+                delay = min(BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX)
+                log.warning('Extracting build failed (%s), retrying in %ds (%d/%d)', e, delay, failures, self.retries)
+                shutil.rmtree(path)
+                os.mkdir(path)
+                time.sleep(delay)
+
+    def _fallback(self, build, path):
+        """
+        Retrieve the build using fuzzfetch, retrying with backoff
+        """
+        failures = 0
+        while True:
+            try:
+                build.extract_build(path)
+                return
+            except Exception as e:  # fuzzfetch doesn't wrap errors raised by requests or extraction
+                failures += 1
+                if failures > self.retries:
+                    raise DownloadError('Unable to retrieve build %s: %s' % (build.changeset, e))
+                delay = min(BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX)
+                log.warning('Retrieving build failed (%s), retrying in %ds (%d/%d)', e, delay, failures, self.retries)
+                shutil.rmtree(path)
+                os.mkdir(path)
+                time.sleep(delay)
+
+    def fetch(self, build, target_path):
+        """
+        Retrieve the supplied build and atomically move it to target_path
+        :param build: An object providing artifact_url(suffix), build_id, changeset, target, branch and flags,
+                      or extract_build(path)
+        :param target_path: The final build directory, which must not exist
+        """
+        name = os.path.basename(target_path)
+        tmp_path = os.path.join(self.work_dir, '%s.%s' % (name, uuid.uuid4().hex[:8]))
+        os.mkdir(tmp_path)
+        try:
+            if platform.system() == 'Linux' and hasattr(build, 'artifact_url'):
+                self._stream(build, tmp_path, name)
+            else:
+                self._fallback(build, tmp_path)
+                self.profile.prune(tmp_path)
+            os.rename(tmp_path, target_path)
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path)
@@ -6,25 +6,80 @@
 
 from __future__ import absolute_import
 
+import hashlib
+import json
 import logging
+import multiprocessing.util
 import os
+import re
+import shutil
 import tempfile
+import threading
 
 from ffpuppet import FFPuppet
 from ffpuppet import LaunchError
+from ffpuppet.exceptions import InvalidPrefs
+from ffpuppet.helpers import create_profile
 
 from ..bisect import Bisector
+from ..download import ExtractionProfile
+from .display import DisplayPool
+from .repeat import SequentialTest
+from .repeat import run_launches
+from .repeat import run_repeats
 
 log = logging.getLogger('browser-eval')
 
+# Tokens of a prefs.js file: whitespace, comments and pref() statements
+PREFS_STRING = r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\''
+PREFS_TOKEN = re.compile(r'\s+|//[^\n]*|#[^\n]*|/\*.*?\*/|'
+                         r'(?:user_pref|pref|sticky_pref)\s*\(\s*(?:%s)\s*,\s*'
+                         r'(?:true|false|[-+]?\d+|%s)\s*\)\s*;' % (PREFS_STRING, PREFS_STRING), re.DOTALL)
+
+
+def validate_prefs(prefs_js):
+    """
+    Check the syntax of a prefs.js file, which Firefox renames to Invalidprefs.js if a statement is invalid
+    :param prefs_js: Path to the prefs.js file
+    :raises InvalidPrefs: If the file is invalid
+    """
+    with open(prefs_js, 'r') as f:
+        content = f.read()
+    pos = 0
+    while pos < len(content):
+        match = PREFS_TOKEN.match(content, pos)
+        if match is None:
+            line = content.count('\n', 0, pos) + 1
+            raise InvalidPrefs('%r is invalid (line %d)' % (prefs_js, line))
+        pos = match.end()
+
 
 class BrowserEvaluator(object):
     """
     Testcase evaluator for Firefox
     """
+    # Debug symbols, tests and update/telemetry helpers aren't used when launching the browser
+    extraction_profile = ExtractionProfile('browser', exclude=(
+        '*.gcno',
+        'gtest/*',
+        'maintenanceservice*',
+        'pingsender',
+        'precomplete',
+        'removed-files',
+        'symbols/*',
+        'tests/*',
+        'update-settings.ini',
+        'updater',
+        'updater.ini',
+    ))
+
     def __init__(self, args):
         self.testcase = args.testcase
         self.repeat = args.repeat
+        self.parallel_repeats = args.parallel_repeats
+        self.sequential_test = None
+        if args.sprt:
+            self.sequential_test = SequentialTest(args.repro_rate, args.sprt_alpha, args.sprt_beta)
 
         # FFPuppet arguments
         self._asserts = args.asserts
@@ -33,12 +88,110 @@ class BrowserEvaluator(object):
         self._use_valgrind = args.valgrind
         self._use_xvfb = args.xvfb
         self._timeout = args.timeout
+        # Multiplier and floor of the timeout learned from the good boundary, see Bisector.measure_timeout()
+        self.adaptive_timeout = None
+        if args.adaptive_timeout:
+            self.adaptive_timeout = (args.timeout_multiplier, args.timeout_floor)
+        self.adapted_timeout = None
         self._launch_timeout = args.launch_timeout
         self._extension = args.ext
         self._prefs = args.prefs
         self._profile = os.path.abspath(args.profile) if args.profile is not None else None
         self._memory = args.memory * 1024 * 1024 if args.memory else 0
 
+        # Shared by all launches, see _profile_template() and DisplayPool
+        self._displays = DisplayPool(self.parallel_repeats) if self._use_xvfb else None
+        self._template = None
+        self._template_lock = threading.Lock()
+
+    def __getstate__(self):
+        # The profile template is removed by the process which created it
+        state = self.__dict__.copy()
+        state['_template'] = None
+        state['_template_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._template_lock = threading.Lock()
+
+    def _profile_template(self):
+        """
+        Returns a profile with the preferences and extension applied, created on first use
+        Each launch runs with a copy of this profile
+        """
+        with self._template_lock:
+            if self._template is None:
+                # Launches using the template don't pass prefs_js to ffpuppet, which would validate it
+                if self._prefs is not None:
+                    validate_prefs(self._prefs)
+                self._template = create_profile(extension=self._extension, prefs_js=self._prefs,
+                                                template=self._profile)
+                log.debug('Created profile template %s', self._template)
+                # Remove templates created by worker processes when these exit
+                multiprocessing.util.Finalize(self, shutil.rmtree, args=(self._template, True), exitpriority=10)
+            return self._template
+
+    def close(self):
+        """
+        Remove the profile template and stop the Xvfb displays
+        """
+        if self._template is not None:
+            shutil.rmtree(self._template, ignore_errors=True)
+            self._template = None
+        if self._displays is not None:
+            self._displays.close()
+
+    def _prefs_hash(self):
+        if self._prefs is None:
+            return None
+        with open(self._prefs, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @property
+    def settings(self):
+        """
+        Returns a string describing the settings which affect the outcome of an evaluation
+        """
+        prefs = self._prefs_hash()
+        return json.dumps({
+            'adaptive_timeout': self.adaptive_timeout,
+            'asserts': self._asserts,
+            'detect': self._detect,
+            'ext': self._extension,
+            'gdb': self._use_gdb,
+            'launch_timeout': self._launch_timeout,
+            'memory': self._memory,
+            'prefs': prefs,
+            'profile': self._profile,
+            'repeat': self.repeat,
+            'sprt': self.sequential_test.settings if self.sequential_test is not None else None,
+            'timeout': self._timeout,
+            'valgrind': self._use_valgrind,
+        }, sort_keys=True)
+
+    @property
+    def timeout(self):
+        """
+        Returns the timeout applied to launches with the testcase
+        """
+        return self.adapted_timeout if self.adapted_timeout is not None else self._timeout
+
+    @property
+    def startup_settings(self):
+        """
+        Returns a string describing the settings which affect the outcome of a build verification
+        """
+        return json.dumps({
+            'ext': self._extension,
+            'gdb': self._use_gdb,
+            'launch_timeout': self._launch_timeout,
+            'prefs': self._prefs_hash(),
+            'profile': self._profile,
+            'valgrind': self._use_valgrind,
+            'xvfb': self._use_xvfb,
+        }, sort_keys=True)
+
     def verify_build(self, binary):
         """
         Verify that build doesn't crash on start
@@ -61,45 +214,96 @@ class BrowserEvaluator(object):
 
         return True
 
-    def evaluate_testcase(self, build_path):
+    def verify(self, build_path):
+        """
+        Verify that the supplied build exists and doesn't crash on start
+        :param build_path: Path to the build directory
+        :return: Boolean
+        """
+        binary = os.path.join(build_path, 'dist', 'bin', 'firefox')
+        return os.path.isfile(binary) and self.verify_build(binary)
+
+    def evaluate_testcase(self, build_path, verified=False):
         """
         Validate build and launch with supplied testcase
+        :param build_path: Path to the build directory
+        :param verified: Skip the build verification if it is already known to pass
         :return: Result of evaluation
         """
+        if verified or self.verify(build_path):
+            launch, cancel = self._launcher(build_path)
+            return run_repeats(launch, self.repeat, self.parallel_repeats, cancel, self.sequential_test)
+
+        return Bisector.BUILD_FAILED
+
+    def measure(self, build_path, count):
+        """
+        Launch the supplied build with the testcase without stopping at the first crash
+        :param build_path: Path to the build directory
+        :param count: Number of launches
+        :return: The list of launch statuses
+        """
+        launch, cancel = self._launcher(build_path)
+        return run_launches(launch, count, self.parallel_repeats, cancel, decide=lambda results: None)[1]
+
+    def _launcher(self, build_path):
+        """
+        Returns a callable performing a single launch of the testcase and a callable which closes running launches
+        :param build_path: Path to the build directory
+        """
         binary = os.path.join(build_path, 'dist', 'bin', 'firefox')
-        if os.path.isfile(binary) and self.verify_build(binary):
-            for _ in range(self.repeat):
-                log.info('> Launching build with testcase...')
-                result = self.launch(binary, self.testcase)
-                if result == Bisector.BUILD_CRASHED:
-                    break
+        active = set()
+        cancelled = threading.Event()
 
-            return result
+        def launch():
+            log.info('> Launching build with testcase...')
+            return self.launch(binary, self.testcase, active, cancelled)
 
-        return Bisector.BUILD_FAILED
+        def cancel():
+            cancelled.set()
+            for ffp in list(active):
+                ffp.close()
+
+        return launch, cancel
 
-    def launch(self, binary, testcase=None):
+    def launch(self, binary, testcase=None, active=None, cancelled=None):
         """
         Launch firefox using the supplied binary and testcase
         :param binary: The path to the firefox binary
         :param testcase: The path to the testcase
+        :param active: A set tracking running FFPuppet instances so that they can be closed from other threads
+        :param cancelled: A threading.Event which is set once running launches are closed
         :return: The return code or None
         """
-        ffp = FFPuppet(use_gdb=self._use_gdb, use_valgrind=self._use_valgrind, use_xvfb=self._use_xvfb)
+        if self._displays is None:
+            return self._launch(binary, testcase, active, cancelled)
+        with self._displays.acquire() as display:
+            return self._launch(binary, testcase, active, cancelled, {'DISPLAY': display})
+
+    def _launch(self, binary, testcase, active, cancelled, env_mod=None):
+        ffp = FFPuppet(use_profile=self._profile_template(), use_gdb=self._use_gdb, use_valgrind=self._use_valgrind)
         if self._asserts:
             ffp.add_abort_token('###!!! ASSERTION:')
 
         result = Bisector.BUILD_PASSED
+        if active is not None:
+            active.add(ffp)
 
         try:
             ffp.launch(
                 str(binary),
+                env_mod=env_mod,
                 location=testcase,
                 launch_timeout=self._launch_timeout,
-                memory_limit=self._memory,
-                prefs_js=self._prefs,
-                extension=self._extension)
-            ffp.wait(self._timeout)
+                memory_limit=self._memory)
+            # Firefox renames prefs.js when it fails to parse it
+            if self._prefs is not None and os.path.isfile(os.path.join(ffp.profile, 'Invalidprefs.js')):
+                raise InvalidPrefs('%r is invalid' % self._prefs)
+            if cancelled is not None and cancelled.is_set():
+                # Cancelled while starting, the result is discarded
+                ffp.close()
+                return None
+            ffp.wait(self.timeout)
 
             if not ffp.is_running():
                 ffp.close()
@@ -133,6 +337,8 @@ class BrowserEvaluator(object):
             log.warn('>> Failed to start browser')
             result = Bisector.BUILD_FAILED
         finally:
+            if active is not None:
+                active.discard(ffp)
             ffp.clean_up()
 
         return result
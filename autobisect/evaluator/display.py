@@ -0,0 +1,92 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+import logging
+import multiprocessing.util
+import os
+import platform
+import threading
+
+log = logging.getLogger('display')
+
+
+class DisplayPool(object):
+    """
+    Long-lived Xvfb displays shared by successive launches
+    Displays are started on first use and belong to the process which started them
+    """
+    def __init__(self, size):
+        """
+        :param size: The maximum number of displays, one per concurrent launch
+        """
+        self.size = size
+        self._cond = threading.Condition()
+        self._idle = []
+        self._servers = []
+        self._pid = None
+
+    def __getstate__(self):
+        # Worker processes start their own displays
+        return {'size': self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state['size'])
+
+    def _start(self):
+        """
+        Start a new Xvfb server
+        :return: The display number
+        """
+        if platform.system() != 'Linux':
+            raise EnvironmentError('Xvfb is only supported on Linux')
+        import xvfbwrapper
+
+        # Older versions of xvfbwrapper point DISPLAY at the new server
+        display = os.environ.get('DISPLAY')
+        server = xvfbwrapper.Xvfb(width=1280, height=1024)
+        server.start()
+        if display is None:
+            os.environ.pop('DISPLAY', None)
+        else:
+            os.environ['DISPLAY'] = display
+
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            # Stop the displays when a worker process exits
+            multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+        self._servers.append(server)
+        log.debug('Started Xvfb on display :%d', server.new_display)
+        return server.new_display
+
+    @contextmanager
+    def acquire(self):
+        """
+        Reserve a display for the duration of a launch
+        :return: A value for the DISPLAY environment variable
+        """
+        with self._cond:
+            while not self._idle and len(self._servers) >= self.size:
+                self._cond.wait()
+            display = self._idle.pop() if self._idle else self._start()
+        try:
+            yield ':%d' % display
+        finally:
+            with self._cond:
+                self._idle.append(display)
+                self._cond.notify()
+
+    def close(self):
+        """
+        Stop all displays
+        """
+        with self._cond:
+            for server in self._servers:
+                server.stop()
+            self._servers = []
+            self._idle = []
@@ -6,12 +6,21 @@
 
 from __future__ import absolute_import
 
+import json
 import logging
 import os
 
 from lithium import interestingness
 
 from ..bisect import Bisector
+from ..download import ExtractionProfile
+from .repeat import ProcessGroupLauncher
+from .repeat import SequentialTest
+from .repeat import run_launches
+from .repeat import run_repeats
+from .stream import compile_matcher
+from .stream import crash_matcher
+from .stream import stream_run
 
 log = logging.getLogger('js-eval')
 
@@ -27,20 +36,72 @@ class JSEvaluator(object):
     """
     Testcase evaluator for SpiderMonkey shells
     """
+    # Only the shell and the libraries shipped alongside it are needed
+    extraction_profile = ExtractionProfile('js', exclude=('*.gcno', 'symbols/*'))
 
     def __init__(self, args):
         self.testcase = os.path.abspath(args.testcase)
         self.repeat = args.repeat
+        self.parallel_repeats = args.parallel_repeats
+        self.sequential_test = None
+        if args.sprt:
+            self.sequential_test = SequentialTest(args.repro_rate, args.sprt_alpha, args.sprt_beta)
 
         # JS Shell launch arguments
         self._detect = args.detect
         self._flags = args.flags
         self._timeout = args.timeout
+        # Multiplier and floor of the timeout learned from the good boundary, see Bisector.measure_timeout()
+        self.adaptive_timeout = None
+        if args.adaptive_timeout:
+            self.adaptive_timeout = (args.timeout_multiplier, args.timeout_floor)
+        self.adapted_timeout = None
         self._arg_1 = args.arg_1
         self._arg_2 = args.arg_2
         self._hang_time = args.hang_time
         self._match = args.match
         self._regex = args.regex
+        self._stream = args.stream
+
+    @property
+    def settings(self):
+        """
+        Returns a string describing the settings which affect the outcome of an evaluation
+        """
+        return json.dumps({
+            'arg_1': self._arg_1,
+            'arg_2': self._arg_2,
+            'detect': self._detect,
+            'flags': self._flags,
+            'hang_time': self._hang_time,
+            'match': self._match,
+            'regex': self._regex,
+            'repeat': self.repeat,
+            'sprt': self.sequential_test.settings if self.sequential_test is not None else None,
+            'stream': self._stream,
+            'timeout': self._timeout,
+            'adaptive_timeout': self.adaptive_timeout,
+        }, sort_keys=True)
+
+    @property
+    def timeout(self):
+        """
+        Returns the timeout applied to launches with the testcase
+        """
+        return self.adapted_timeout if self.adapted_timeout is not None else self._timeout
+
+    @property
+    def startup_settings(self):
+        """
+        Returns a string describing the settings which affect the outcome of a build verification
+        """
+        return json.dumps({'timeout': self._timeout}, sort_keys=True)
+
+    def close(self):
+        """
+        Release resources held between launches, the shell doesn't need any
+        """
+        pass
 
     def verify_build(self, binary):
         """
@@ -57,37 +118,97 @@ class JSEvaluator(object):
 
         return True
 
-    def evaluate_testcase(self, build_path):
+    def verify(self, build_path):
+        """
+        Verify that the supplied build doesn't crash on start
+        :param build_path: Path to the build directory
+        :return: Boolean
+        """
+        return self.verify_build(os.path.join(build_path, 'js'))
+
+    def evaluate_testcase(self, build_path, verified=False):
         """
         Validate build and launch with supplied testcase
+        :param build_path: Path to the build directory
+        :param verified: Skip the build verification if it is already known to pass
         :return: Result of evaluation
         """
+        if verified or self.verify(build_path):
+            launch, cancel = self._launcher(build_path)
+            result = run_repeats(launch, self.repeat, self.parallel_repeats, cancel, self.sequential_test)
+            return Bisector.BUILD_CRASHED if result == Bisector.BUILD_CRASHED else Bisector.BUILD_PASSED
+
+        return Bisector.BUILD_FAILED
+
+    def measure(self, build_path, count):
+        """
+        Launch the supplied build with the testcase without stopping at the first crash
+        :param build_path: Path to the build directory
+        :param count: Number of launches
+        :return: The list of launch statuses
+        """
+        launch, cancel = self._launcher(build_path)
+        return run_launches(launch, count, self.parallel_repeats, cancel, decide=lambda results: None)[1]
+
+    def _launcher(self, build_path):
+        """
+        Returns a callable performing a single launch of the testcase and a callable which kills running launches
+        :param build_path: Path to the build directory
+        """
         binary = os.path.join(build_path, 'js')
-        common_args = ['-t', '%s' % self._timeout, binary]
+        shell_args = [binary]
         if self._flags is not None:
-            common_args.extend(self._flags.split(' '))
+            shell_args.extend(self._flags.split(' '))
 
         # These args are global to all detect types
-        common_args.append(self.testcase)
-
-        if self.verify_build(binary):
-            for _ in range(self.repeat):
-                log.info('> Launching build with testcase...')
-                if self._detect == 'diff':
-                    args = ['-a', self._arg_1, '-b', self._arg_2] + common_args
-                    if interestingness.diff_test.interesting(args, None):
-                        return Bisector.BUILD_CRASHED
-                elif self._detect == 'output':
-                    args = [self._match, self.testcase] + common_args
-                    if interestingness.outputs.interesting(args, None):
-                        return Bisector.BUILD_CRASHED
-                elif self._detect == 'crash':
-                    if interestingness.crashes.interesting(common_args, None):
-                        return Bisector.BUILD_CRASHED
-                elif self._detect == 'hang':
-                    if interestingness.hangs.interesting(common_args, None):
-                        return Bisector.BUILD_CRASHED
-
-            return Bisector.BUILD_PASSED
+        shell_args.append(self.testcase)
 
-        return Bisector.BUILD_FAILED
+        if self._stream:
+            launch, launch_args = self.stream_launch, shell_args
+        else:
+            launch, launch_args = self.launch, ['-t', '%s' % self.timeout] + shell_args
+
+        if self.parallel_repeats <= 1:
+            return lambda: launch(launch_args), None
+
+        # Each launch runs in its own process group so that cancelled launches can be killed
+        launcher = ProcessGroupLauncher()
+        return lambda: launcher.call(launch, launch_args), launcher.cancel
+
+    def launch(self, common_args):
+        """
+        Launch the shell once using the configured detection method
+        :param common_args: Arguments shared by all detection methods
+        :return: BUILD_CRASHED if the testcase was interesting, otherwise BUILD_PASSED
+        """
+        log.info('> Launching build with testcase...')
+        if self._detect == 'diff':
+            args = ['-a', self._arg_1, '-b', self._arg_2] + common_args
+            interesting = interestingness.diff_test.interesting(args, None)
+        elif self._detect == 'output':
+            args = [self._match, self.testcase] + common_args
+            interesting = interestingness.outputs.interesting(args, None)
+        elif self._detect == 'crash':
+            interesting = interestingness.crashes.interesting(common_args, None)
+        else:
+            interesting = interestingness.hangs.interesting(common_args, None)
+
+        return Bisector.BUILD_CRASHED if interesting else Bisector.BUILD_PASSED
+
+    def stream_launch(self, shell_args):
+        """
+        Launch the shell once, searching its output while it runs and stopping it at the first match
+        :param shell_args: The shell command line
+        :return: BUILD_CRASHED if the testcase was interesting, otherwise BUILD_PASSED
+        """
+        log.info('> Launching build with testcase...')
+        if self._detect == 'output':
+            result = stream_run(shell_args, compile_matcher(self._match, bool(self._regex)), self.timeout)
+            interesting = result.matched
+        else:
+            result = stream_run(shell_args, crash_matcher(), self.timeout)
+            interesting = result.matched or result.crashed
+
+        if result.timed_out:
+            log.info('>> Timed out')
+        return Bisector.BUILD_CRASHED if interesting else Bisector.BUILD_PASSED
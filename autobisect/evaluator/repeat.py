@@ -0,0 +1,271 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import traceback
+
+from ..bisect import Bisector
+
+log = logging.getLogger('repeat')
+
+
+# Probability of a good build being reported as crashed, which keeps a single spurious crash from being conclusive
+FALSE_CRASH_RATE = 0.01
+# Reproduction rate assumed until it is measured on the bad bound
+DEFAULT_REPRO_RATE = 0.5
+
+
+class SequentialTest(object):
+    """
+    Sequential probability ratio test deciding whether a build reproduces an intermittent testcase
+    H0: the build is good and crashes with probability FALSE_CRASH_RATE
+    H1: the build is bad and crashes with probability repro_rate
+    """
+    def __init__(self, repro_rate=None, alpha=0.05, beta=0.05):
+        """
+        :param repro_rate: Probability that a bad build reproduces the testcase, None if it should be measured
+        :param alpha: Probability of reporting a good build as crashed
+        :param beta: Probability of reporting a bad build as passed
+        """
+        self.configured_rate = repro_rate
+        self.repro_rate = repro_rate
+        self.alpha = alpha
+        self.beta = beta
+
+    @property
+    def settings(self):
+        """
+        Returns the parameters which affect the outcome of an evaluation, including the measured reproduction rate
+        """
+        rate = round(self.repro_rate, 3) if self.repro_rate is not None else None
+        return [self.configured_rate, rate, self.alpha, self.beta]
+
+    def log_likelihood_ratio(self, results):
+        """
+        Returns the log-likelihood ratio of H1 against H0 for the launches observed so far
+        :param results: A list of launch statuses
+        """
+        p1 = self.repro_rate if self.repro_rate is not None else DEFAULT_REPRO_RATE
+        p1 = min(max(p1, FALSE_CRASH_RATE * 2), 0.99)
+        crashes = results.count(Bisector.BUILD_CRASHED)
+        passes = results.count(Bisector.BUILD_PASSED)
+        return (crashes * math.log(p1 / FALSE_CRASH_RATE) +
+                passes * math.log((1 - p1) / (1 - FALSE_CRASH_RATE)))
+
+    def decide(self, results):
+        """
+        Evaluate the launches observed so far
+        :param results: A list of launch statuses
+        :return: BUILD_CRASHED or BUILD_PASSED once the test is conclusive, otherwise None
+        """
+        llr = self.log_likelihood_ratio(results)
+        if llr >= math.log((1 - self.beta) / self.alpha):
+            return Bisector.BUILD_CRASHED
+        if llr <= math.log(self.beta / (1 - self.alpha)):
+            return Bisector.BUILD_PASSED
+        return None
+
+    def conclude(self, results):
+        """
+        Decide an inconclusive test in favour of the hypothesis supported by the launches
+        :param results: A list of launch statuses
+        :return: BUILD_CRASHED or BUILD_PASSED, None if no launch crashed or passed
+        """
+        if Bisector.BUILD_CRASHED not in results and Bisector.BUILD_PASSED not in results:
+            return None
+        return Bisector.BUILD_CRASHED if self.log_likelihood_ratio(results) > 0 else Bisector.BUILD_PASSED
+
+
+def _stop_on_crash(results):
+    return Bisector.BUILD_CRASHED if results[-1] == Bisector.BUILD_CRASHED else None
+
+
+def run_launches(launch, count, parallel=1, cancel=None, decide=_stop_on_crash):
+    """
+    Call launch() up to count times using up to parallel concurrent launches
+    No further launches are started once decide() reaches a conclusion and the running launches are cancelled
+    :param launch: A callable returning the status of a single launch
+    :param count: The maximum number of launches
+    :param parallel: The maximum number of concurrent launches
+    :param cancel: A callable which aborts the running launches
+    :param decide: A callable receiving the list of statuses observed so far and returning a final status or None
+    :return: A tuple containing the final status (or None) and the list of observed statuses
+    """
+    results = []
+    if parallel <= 1:
+        for _ in range(count):
+            results.append(launch())
+            decision = decide(results)
+            if decision is not None:
+                return decision, results
+        return None, results
+
+    lock = threading.Lock()
+    state = {'remaining': count, 'decision': None, 'error': None}
+
+    def stopped():
+        return state['decision'] is not None or state['error'] is not None
+
+    def worker():
+        while True:
+            with lock:
+                if stopped() or not state['remaining']:
+                    return
+                state['remaining'] -= 1
+            try:
+                result = launch()
+            except Exception as e:  # pylint: disable=broad-except
+                result = e
+            with lock:
+                # Results of cancelled launches are meaningless
+                if stopped():
+                    return
+                if isinstance(result, Exception):
+                    state['error'] = result
+                else:
+                    results.append(result)
+                    state['decision'] = decide(results)
+                conclusive = stopped()
+            if conclusive:
+                if cancel is not None:
+                    log.info('>> Cancelling the remaining launches')
+                    cancel()
+                return
+
+    threads = [threading.Thread(target=worker) for _ in range(min(parallel, count))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if state['error'] is not None:
+        raise state['error']
+    return state['decision'], results
+
+
+def run_repeats(launch, count, parallel=1, cancel=None, sequential_test=None):
+    """
+    Evaluate a build using repeated launches
+    Without a sequential test, launches stop at the first crash
+    With a sequential test, the build is considered crashed if the launches favour H1 once count is exhausted
+    :param launch: A callable returning the status of a single launch
+    :param count: The maximum number of launches
+    :param parallel: The maximum number of concurrent launches
+    :param cancel: A callable which aborts the running launches
+    :param sequential_test: An optional SequentialTest deciding when to stop
+    :return: The final status, or the status of the last launch if no conclusion was reached
+    """
+    decide = sequential_test.decide if sequential_test is not None else _stop_on_crash
+    decision, results = run_launches(launch, count, parallel, cancel, decide)
+    if decision is not None:
+        return decision
+    if sequential_test is not None:
+        decision = sequential_test.conclude(results)
+        if decision is not None:
+            log.info('>> Inconclusive after %d launches, assuming %s', len(results),
+                     'crashed' if decision == Bisector.BUILD_CRASHED else 'passed')
+            return decision
+    return results[-1] if results else None
+
+
+class _ForkedProcess(object):
+    """
+    Minimal replacement for multiprocessing.Process which can be started from daemonic processes
+    """
+    def __init__(self, target, args):
+        self._target = target
+        self._args = args
+        self.pid = None
+
+    def start(self):
+        self.pid = os.fork()
+        if self.pid == 0:
+            code = 1
+            try:
+                self._target(*self._args)
+                code = 0
+            except BaseException:  # pylint: disable=broad-except
+                traceback.print_exc()
+            finally:
+                # Skip the cleanup handlers inherited from the parent
+                os._exit(code)  # pylint: disable=protected-access
+
+    def join(self):
+        os.waitpid(self.pid, 0)
+
+    def terminate(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def _call_in_group(conn, func, args):
+    # Lead a new process group so that the launched target is killed along with this process
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    conn.send(func(*args))
+
+
+class ProcessGroupLauncher(object):
+    """
+    Runs launches in separate process groups so that they can be killed along with the processes they spawn
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = set()
+        self._cancelled = False
+
+    def call(self, func, *args):
+        """
+        Call func(*args) in a child process
+        Children of daemonic processes are forked directly, except where fork() isn't available
+        :return: The return value of func or None if the launch was cancelled
+        """
+        # Daemonic processes (ex. multiprocessing.Pool workers) aren't allowed to have children by multiprocessing
+        if not multiprocessing.current_process().daemon:
+            process_class = multiprocessing.Process
+        elif hasattr(os, 'fork'):
+            process_class = _ForkedProcess
+        else:
+            return func(*args)
+
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        proc = process_class(target=_call_in_group, args=(writer, func, args))
+        with self._lock:
+            if self._cancelled:
+                return None
+            proc.start()
+            self._procs.add(proc)
+        try:
+            proc.join()
+            return reader.recv() if reader.poll() else None
+        finally:
+            with self._lock:
+                self._procs.discard(proc)
+            reader.close()
+            writer.close()
+
+    def cancel(self):
+        """
+        Kill all running launches and prevent further launches
+        """
+        with self._lock:
+            self._cancelled = True
+            procs = list(self._procs)
+        for proc in procs:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                # The child may not have created its process group yet
+                proc.terminate()
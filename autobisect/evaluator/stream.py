@@ -0,0 +1,106 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import codecs
+import logging
+import os
+import re
+import subprocess
+import threading
+
+log = logging.getLogger('stream')
+
+CHUNK_SIZE = 4096
+
+# Output printed by shells which are about to crash
+# Limited to failures which lithium's crash detection reports, so that streamed and
+# non-streamed launches agree (UBSan and LeakSanitizer reports aren't crashes to lithium)
+CRASH_SIGNATURES = (
+    'Assertion failure:',
+    'Hit MOZ_CRASH',
+    'ERROR: AddressSanitizer',
+)
+
+
+def compile_matcher(pattern, regex=False):
+    """
+    Returns a compiled expression searching for the supplied pattern
+    :param pattern: The string to search for
+    :param regex: Whether pattern is a regular expression
+    """
+    return re.compile(pattern if regex else re.escape(pattern))
+
+
+def crash_matcher():
+    """
+    Returns a compiled expression searching for any of the crash signatures
+    """
+    return re.compile('|'.join(re.escape(s) for s in CRASH_SIGNATURES))
+
+
+class StreamResult(object):
+    """
+    Outcome of a streamed run
+    """
+    def __init__(self, matched, returncode, timed_out):
+        self.matched = matched
+        self.returncode = returncode
+        self.timed_out = timed_out
+
+    @property
+    def crashed(self):
+        """
+        Returns whether the process was killed by a signal other than the ones sent by stream_run()
+        """
+        return self.returncode is not None and self.returncode < 0 and not (self.matched or self.timed_out)
+
+
+def stream_run(args, matcher, timeout):
+    """
+    Run a command while searching its output, killing it as soon as the matcher finds a match
+    Output is searched line by line as it is produced, including the trailing incomplete line
+    :param args: The command to run
+    :param matcher: A compiled expression applied to stdout and stderr
+    :param timeout: Seconds after which the process is killed
+    :return: A StreamResult
+    """
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    state = {'timed_out': False}
+
+    def expire():
+        state['timed_out'] = True
+        proc.kill()
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+
+    matched = False
+    pending = ''
+    # Multi-byte characters may be split across chunks
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    try:
+        fd = proc.stdout.fileno()
+        while True:
+            chunk = os.read(fd, CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (pending + decoder.decode(chunk)).split('\n')
+            # The incomplete last line is searched again once it grows
+            pending = lines.pop()
+            if any(matcher.search(line) for line in lines + [pending]):
+                matched = True
+                log.info('>> Match found, killing process')
+                proc.kill()
+                break
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+        proc.wait()
+
+    return StreamResult(matched, proc.returncode, state['timed_out'])
@@ -14,12 +14,20 @@ import os
 import re
 import time
 
+from .batch import BatchBisector
+from .batch import collect_testcases
 from .bisect import Bisector
+from .bisect import ResumeError
 from .evaluator.browser import BrowserEvaluator
 from .evaluator.js import JSEvaluator
+from .service import JobError
+from .service import serve
 
 log = logging.getLogger('autobisect')
 
+# Default maximum number of launches per build with --sprt
+SPRT_MAX_LAUNCHES = 20
+
 
 class ExpandPath(argparse.Action):
     """
@@ -43,14 +51,59 @@ def _parse_args(argv=None):
                                help='Start revision (default: earliest available TC build)')
     boundary_args.add_argument('--end', default=datetime.utcnow().strftime('%Y-%m-%d'),
                                help='End revision (default: latest available TC build)')
+    boundary_args.add_argument('--auto-start', action='store_true',
+                               help='Search for the start revision 1, 2, 4, 8... days before the end revision, '
+                                    'going no further than --start')
 
     bisection_args = global_args.add_argument_group('bisection arguments')
     bisection_args.add_argument('--timeout', type=int, default=60,
                                 help='Maximum iteration time in seconds (default: %(default)s)')
-    bisection_args.add_argument('--repeat', type=int, default=1,
-                                help='Number of times to evaluate testcase (per build)')
+    bisection_args.add_argument('--adaptive-timeout', action='store_true',
+                                help='Derive the timeout from the run time of the testcase on the good boundary, '
+                                     'capped by --timeout')
+    bisection_args.add_argument('--timeout-multiplier', type=float, default=3.0,
+                                help='Multiple of the good boundary run time used with --adaptive-timeout '
+                                     '(default: %(default)s)')
+    bisection_args.add_argument('--timeout-floor', type=int, default=5,
+                                help='Minimum timeout in seconds with --adaptive-timeout (default: %(default)s)')
+    bisection_args.add_argument('--repeat', type=int,
+                                help='Number of times to evaluate testcase (per build), the maximum number of '
+                                     'launches with --sprt (default: 1, or %d with --sprt)' % SPRT_MAX_LAUNCHES)
+    bisection_args.add_argument('--parallel-repeats', type=int, default=1, metavar='K',
+                                help='Number of repeats to run concurrently, the others are cancelled once one '
+                                     'crashes (default: %(default)s)')
+    bisection_args.add_argument('--sprt', action='store_true',
+                                help='Stop launching a build once a sequential probability ratio test determines '
+                                     'whether it reproduces the testcase')
+    bisection_args.add_argument('--repro-rate', type=float,
+                                help='Probability that a bad build reproduces the testcase with --sprt '
+                                     '(default: measured on the bad boundary)')
+    bisection_args.add_argument('--sprt-alpha', type=float, default=0.05,
+                                help='Probability of reporting a good build as bad with --sprt (default: %(default)s)')
+    bisection_args.add_argument('--sprt-beta', type=float, default=0.05,
+                                help='Probability of reporting a bad build as good with --sprt (default: %(default)s)')
     bisection_args.add_argument('--config', action=ExpandPath, help='Path to optional config file')
     bisection_args.add_argument('--find-fix', action='store_true', help='Identify fix date')
+    bisection_args.add_argument('--prefetch', action='store_true',
+                                help='Download the next candidate builds while the current build is evaluated')
+    bisection_args.add_argument('--jobs', type=int, default=1,
+                                help='Number of builds to evaluate concurrently (default: %(default)s)')
+    bisection_args.add_argument('--no-cache', action='store_true',
+                                help='Re-evaluate builds instead of using previously recorded results')
+    bisection_args.add_argument('--resume', metavar='ID', help='Resume an interrupted bisection')
+    bisection_args.add_argument('--batch', action='store_true',
+                                help='Bisect every testcase of a directory, or listed in a file (one path per line), '
+                                     'downloading each build once for all testcases')
+    bisection_args.add_argument('--engine', choices=['two-phase', 'single-pass', 'bayesian'], default='two-phase',
+                                help='Bisection strategy: daily builds followed by the pushes of the final days, '
+                                     'all available builds in a single pass, or a probabilistic search tolerating '
+                                     'intermittent results (default: %(default)s)')
+    bisection_args.add_argument('--confidence', type=float, default=0.95,
+                                help='Probability of the culprit at which the bayesian engine stops '
+                                     '(default: %(default)s)')
+    bisection_args.add_argument('--false-negative-rate', type=float,
+                                help='Probability of a bad build being evaluated as good, used by the bayesian engine '
+                                     '(default: estimated from the bad boundary)')
 
     branch_args = global_args.add_argument_group('branch')
     branch_selector = branch_args.add_mutually_exclusive_group()
@@ -95,6 +148,9 @@ def _parse_args(argv=None):
     js_args.add_argument('--flags', help='Runtime flags to pass to the binary')
     js_args.add_argument('--detect', choices=['crash', 'diff', 'hang', 'output'], default='crash',
                          help='Type of failure to detect (default: %(default)s)')
+    js_args.add_argument('--stream', action='store_true',
+                         help='Search the output while the shell runs and stop it once the match or a crash '
+                              'signature appears (crash and output detection only)')
 
     js_diff_args = js_sub.add_argument_group('diff arguments')
     js_diff_args.add_argument('--arg_1', help='Set of arguments to supply to the first run')
@@ -108,8 +164,21 @@ def _parse_args(argv=None):
     js_out_args.add_argument('--match', help='Mark as interesting if string detected in output')
     js_out_args.add_argument('--regex', help='Treat match as a regex')
 
+    serve_sub = subparsers.add_parser('serve', help='Run bisections submitted over a local HTTP API')
+    serve_args = serve_sub.add_argument_group('service arguments')
+    serve_args.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: %(default)s)')
+    serve_args.add_argument('--port', type=int, default=8080, help='Port to listen on (default: %(default)s)')
+    serve_args.add_argument('--socket', action=ExpandPath, help='Listen on a unix socket instead of a port')
+    serve_args.add_argument('--workers', type=int, default=2,
+                            help='Number of bisections run concurrently (default: %(default)s)')
+
     args = parser.parse_args(argv)
 
+    if args.target == 'serve':
+        if args.workers <= 0:
+            parser.error('Invalid workers value supplied')
+        return args
+
     if not args.branch:
         args.branch = 'central'
 
@@ -119,12 +188,45 @@ def _parse_args(argv=None):
         parser.error('Invalid end value supplied')
     if args.timeout <= 0:
         parser.error('Invalid timeout value supplied')
+    if args.timeout_multiplier < 1:
+        parser.error('Invalid timeout multiplier supplied')
+    if args.timeout_floor <= 0:
+        parser.error('Invalid timeout floor supplied')
+    if args.jobs <= 0:
+        parser.error('Invalid jobs value supplied')
+    if args.parallel_repeats <= 0:
+        parser.error('Invalid parallel repeats value supplied')
+    if args.repeat is None:
+        args.repeat = SPRT_MAX_LAUNCHES if args.sprt else 1
+    if args.repeat <= 0:
+        parser.error('Invalid repeat value supplied')
+    if args.repro_rate is not None and not 0 < args.repro_rate < 1:
+        parser.error('Invalid reproduction rate supplied')
+    if not 0 < args.sprt_alpha < 0.5 or not 0 < args.sprt_beta < 0.5:
+        parser.error('Invalid error rates supplied')
+    if not 0 < args.confidence < 1:
+        parser.error('Invalid confidence supplied')
+    if args.false_negative_rate is not None and not 0 < args.false_negative_rate < 1:
+        parser.error('Invalid false negative rate supplied')
+
+    if args.batch:
+        if not os.path.exists(args.testcase) or not collect_testcases(args.testcase):
+            parser.error('No testcases found in %s' % args.testcase)
+        if args.resume is not None or args.auto_start or args.adaptive_timeout:
+            parser.error('Batch mode can not be combined with --resume, --auto-start or --adaptive-timeout')
+        if args.engine != 'two-phase' or args.jobs > 1:
+            parser.error('Batch mode only supports the two-phase engine without --jobs')
+        # The reproduction rate differs between testcases and is not measured in batch mode
+        if args.sprt and args.repro_rate is None:
+            parser.error('Batch mode requires --repro-rate when combined with --sprt')
 
     if args.target == 'firefox':
         if args.detect == 'log' and args.log_limit is None:
             parser.error('Detect mode set to log-limit but no limit set!')
         if args.detect == 'memory' and args.memory is None:
             parser.error('Detect mode set to log-limit but no limit set!')
+        if args.detect == 'timeout' and args.adaptive_timeout:
+            parser.error('Adaptive timeouts can not be used when detecting timeouts!')
     elif args.target == 'js':
         if args.detect == 'diff':
             if not args.arg_1 or not args.args_2:
@@ -136,9 +238,13 @@ def _parse_args(argv=None):
                 parser.error('Invalid hangout threshold value supplied!')
             if args.hang_time > args.timeout:
                 parser.error('Hang threshold greater than timeout!')
+            if args.adaptive_timeout:
+                parser.error('Adaptive timeouts can not be used when detecting hangs!')
         if args.detect == 'output':
             if args.match is None:
                 parser.error('Detect mode set to output but no output string supplied!')
+        if args.stream and args.detect not in ('crash', 'output'):
+            parser.error('Streaming is only supported when detecting crashes or output!')
 
     return args
 
@@ -156,15 +262,53 @@ def main(argv=None):
     logging.getLogger('requests').setLevel(logging.WARNING)
 
     args = _parse_args(argv)
+    if args.target == 'serve':
+        serve(args, _parse_job_args, run)
+        return
 
+    start_time = time.time()
+    try:
+        result = run(args)
+    except ResumeError as e:
+        log.critical('Unable to resume bisection: %s', e)
+        return
+    if result is not None:
+        elapsed = timedelta(seconds=(int(time.time() - start_time)))
+        log.info('Bisection completed in: %s' % elapsed)
+
+
+def _parse_job_args(argv):
+    """
+    Parse the command line of a bisection submitted to the service
+    :raises JobError: If the arguments are invalid
+    """
+    try:
+        args = _parse_args(argv)
+    except SystemExit:
+        raise JobError('Invalid arguments, see usage: %s' % ' '.join(argv))
+    if args.target not in ('firefox', 'js'):
+        raise JobError('Invalid target supplied')
+    return args
+
+
+def run(args, bisection_id=None):
+    """
+    Perform a bisection
+    :param args: The parsed bisection arguments
+    :param bisection_id: The id of a new bisection, generated if not supplied
+    :return: The result of Bisector.bisect() or None
+    :raises ResumeError: If the bisection to resume doesn't exist or doesn't match the arguments
+    """
     if args.target == 'firefox':
         evaluator = BrowserEvaluator(args)
     else:
         evaluator = JSEvaluator(args)
 
-    bisector = Bisector(evaluator, args)
-    start_time = time.time()
-    bisector.bisect()
-    end_time = time.time()
-    elapsed = timedelta(seconds=(int(end_time - start_time)))
-    log.info('Bisection completed in: %s' % elapsed)
+    try:
+        if args.batch:
+            bisector = BatchBisector(evaluator, args, collect_testcases(args.testcase))
+        else:
+            bisector = Bisector(evaluator, args, bisection_id)
+        return bisector.bisect()
+    finally:
+        evaluator.close()
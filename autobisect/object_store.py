@@ -0,0 +1,146 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import logging
+import os
+import stat
+
+log = logging.getLogger('object-store')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ObjectStore(object):
+    """
+    Content-addressed store of build files shared between builds using hardlinks
+    The link count of an object is its reference count: objects only linked from the store are unused
+    """
+    def __init__(self, path):
+        """
+        :param path: The object directory, which must be on the same filesystem as the builds
+        """
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def digest(file_path, mode):
+        """
+        Returns the digest of the supplied file
+        Linked files share their permissions so these are part of the digest
+        :param file_path: Path to the file
+        :param mode: The st_mode of the file
+        """
+        h = hashlib.sha1(('%o\0' % stat.S_IMODE(mode)).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def object_path(self, digest):
+        """
+        Returns the path of the object matching the supplied digest
+        """
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def ingest(self, build_path):
+        """
+        Replace the files of a build with links to stored objects
+        :param build_path: Path to the build directory
+        :return: The number of bytes added to the store
+        """
+        added = 0
+        linked = set()
+        for dirpath, _, filenames in os.walk(build_path):
+            for f in filenames:
+                fp = os.path.join(dirpath, f)
+                st = os.lstat(fp)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                if st.st_nlink > 1:
+                    # Hardlinked within the archive, stored as is
+                    if st.st_ino not in linked:
+                        linked.add(st.st_ino)
+                        added += st.st_size
+                    continue
+
+                obj = self.object_path(self.digest(fp, st.st_mode))
+                try:
+                    os.mkdir(os.path.dirname(obj))
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                try:
+                    os.link(fp, obj)
+                    added += st.st_size
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    # Atomically replace the file with a link to the existing object
+                    tmp = '%s.dedupe' % fp
+                    os.link(obj, tmp)
+                    os.rename(tmp, fp)
+        return added
+
+    @staticmethod
+    def exclusive_size(build_path):
+        """
+        Returns the number of bytes which are freed from the store once the supplied build is removed
+        :param build_path: Path to the build directory
+        """
+        links = {}
+        for dirpath, _, filenames in os.walk(build_path):
+            for f in filenames:
+                try:
+                    st = os.lstat(os.path.join(dirpath, f))
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    count, _, _ = links.get(st.st_ino, (0, None, None))
+                    links[st.st_ino] = (count + 1, st.st_nlink, st.st_size)
+        # Files are freed once every link outside of the store belongs to this build
+        # Objects have one more link than their uses, files hardlinked within the archive are only linked by the build
+        return sum(size for count, nlink, size in links.values() if count >= nlink - 1)
+
+    @staticmethod
+    def disk_usage(paths):
+        """
+        Returns the number of bytes used by the supplied directories, counting each hardlinked file once
+        :param paths: A list of directories
+        """
+        seen = set()
+        total_size = 0
+        for path in paths:
+            for dirpath, _, filenames in os.walk(path):
+                for f in filenames:
+                    try:
+                        st = os.lstat(os.path.join(dirpath, f))
+                    except OSError:
+                        continue
+                    if (st.st_dev, st.st_ino) not in seen:
+                        seen.add((st.st_dev, st.st_ino))
+                        total_size += st.st_size
+        return total_size
+
+    def collect(self):
+        """
+        Remove objects which are no longer used by any build
+        :return: The number of bytes freed
+        """
+        freed = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            for f in filenames:
+                fp = os.path.join(dirpath, f)
+                st = os.lstat(fp)
+                if st.st_nlink == 1:
+                    os.unlink(fp)
+                    freed += st.st_size
+        log.debug('Removed %d bytes of unused objects', freed)
+        return freed
@@ -0,0 +1,322 @@
+# coding=utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import os
+import platform
+import threading
+import time
+import uuid
+
+from fuzzfetch import BuildFlags
+
+from .batch import collect_testcases
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from socketserver import UnixStreamServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from SocketServer import UnixStreamServer
+
+log = logging.getLogger('service')
+
+# Arguments which don't affect the outcome of a bisection
+IGNORED_ARGS = ('testcase', 'resume', 'prefetch', 'jobs', 'parallel_repeats')
+
+
+class JobError(Exception):
+    """
+    Raised when a submitted job is invalid
+    """
+    pass
+
+
+class Job(object):
+    """
+    A bisection submitted to the service
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, argv, args, key, group):
+        """
+        :param argv: The command line arguments of the bisection
+        :param args: The parsed arguments
+        :param key: A string identifying jobs with an identical outcome
+        :param group: A string identifying jobs which use the same builds
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.argv = argv
+        self.args = args
+        self.key = key
+        self.group = group
+        # Reported as soon as the job is queued so that an interrupted bisection can be resumed
+        # Batch bisections are not checkpointed
+        self.bisection_id = None if args.batch else (args.resume or uuid.uuid4().hex[:12])
+        self.status = self.QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        """
+        Returns a JSON serializable description of the job
+        """
+        return {
+            'id': self.id,
+            'args': self.argv,
+            'group': self.group,
+            'bisection_id': self.bisection_id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+def job_key(args):
+    """
+    Returns a string identifying bisections with an identical outcome
+    :param args: The parsed bisection arguments
+    """
+    testcase = hashlib.sha1()
+    for path in collect_testcases(args.testcase) if args.batch else [args.testcase]:
+        with open(path, 'rb') as f:
+            testcase.update(hashlib.sha1(f.read()).digest())
+    testcase = testcase.hexdigest()
+    options = dict((k, v) for k, v in vars(args).items() if k not in IGNORED_ARGS)
+    return hashlib.sha1(json.dumps([testcase, options], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def job_group(args):
+    """
+    Returns a string identifying bisections which evaluate the same builds
+    :param args: The parsed bisection arguments
+    """
+    flags = BuildFlags(asan=args.asan, debug=args.debug, fuzzing=args.fuzzing, coverage=args.coverage)
+    return '%s-%s-%s%s' % (args.target, args.branch, platform.system().lower(), flags.build_string())
+
+
+class JobQueue(object):
+    """
+    Runs submitted bisections on a bounded number of worker threads
+    Workers share a BuildManager per build configuration, identical jobs are only run once and jobs using the builds of
+    running jobs are started first so that downloaded builds are reused while still cached
+    """
+    def __init__(self, workers, parse, run):
+        """
+        :param workers: The number of bisections run concurrently
+        :param parse: A callable returning the parsed arguments of a command line, raising JobError if invalid
+        :param run: A callable performing a bisection from parsed arguments and a bisection id and returning its result
+        """
+        self.workers = workers
+        self._parse = parse
+        self._run = run
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._pending = []
+        self._running = []
+        self._stopped = False
+        self._threads = []
+
+    def submit(self, argv):
+        """
+        Queue a bisection unless an identical one is already queued or running
+        :param argv: The command line arguments of the bisection
+        :return: A tuple containing the Job object and whether it is a duplicate
+        """
+        args = self._parse(argv)
+        key = job_key(args)
+        with self._cond:
+            for job in self._pending + self._running:
+                if job.key == key:
+                    return job, True
+            job = Job(argv, args, key, job_group(args))
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._cond.notify()
+        log.info('Queued job %s: %s', job.id, ' '.join(argv))
+        return job, False
+
+    def get(self, job_id):
+        """
+        Returns the job matching the supplied id or None
+        """
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """
+        Returns all submitted jobs sorted by submission time
+        """
+        with self._cond:
+            return sorted(self._jobs.values(), key=lambda j: j.created)
+
+    def _next(self):
+        """
+        Returns the next job to run, preferring jobs which use the same builds as running jobs
+        Must be called with the lock held
+        """
+        groups = set(job.group for job in self._running)
+        for job in self._pending:
+            if job.group in groups:
+                break
+        else:
+            job = self._pending[0]
+        self._pending.remove(job)
+        return job
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                job = self._next()
+                job.status = Job.RUNNING
+                job.started = time.time()
+                self._running.append(job)
+
+            log.info('Starting job %s', job.id)
+            try:
+                result = self._run(job.args, job.bisection_id)
+                if result is None:
+                    job.error = 'Unable to verify boundaries'
+                job.result = result
+            except Exception as e:  # pylint: disable=broad-except
+                log.exception('Job %s failed', job.id)
+                job.error = str(e)
+
+            with self._cond:
+                job.status = Job.FAILED if job.error is not None else Job.DONE
+                job.finished = time.time()
+                self._running.remove(job)
+            log.info('Finished job %s (%s)', job.id, job.status)
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop accepting queued jobs, running bisections can be continued later by submitting them with --resume
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API:
+      POST /jobs with {"args": [<command line>]} queues a bisection
+      GET /jobs lists all jobs
+      GET /jobs/<id> returns the status and result of a job
+    """
+    def _reply(self, code, data):
+        body = json.dumps(data, indent=2, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, fmt, *args):
+        log.debug('%s %s', self.address_string(), fmt % args)
+
+    def do_GET(self):  # noqa pylint: disable=invalid-name
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            self._reply(200, [job.to_dict() for job in self.server.queue.jobs()])
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.server.queue.get(parts[1])
+            if job is None:
+                self._reply(404, {'error': 'No job found matching id %s' % parts[1]})
+            else:
+                self._reply(200, job.to_dict())
+        else:
+            self._reply(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):  # noqa pylint: disable=invalid-name
+        if self.path.strip('/') != 'jobs':
+            self._reply(404, {'error': 'Unknown path %s' % self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            argv = request['args']
+            if not isinstance(argv, list) or not all(isinstance(arg, type(u'')) for arg in argv):
+                raise JobError('args must be a list of strings')
+            job, duplicate = self.server.queue.submit([str(arg) for arg in argv])
+        except (JobError, IOError, KeyError, OSError, TypeError, ValueError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        data = job.to_dict()
+        data['duplicate'] = duplicate
+        self._reply(200 if duplicate else 201, data)
+
+
+class _TCPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(args, parse, run):
+    """
+    Run the bisection service until interrupted
+    :param args: The parsed service arguments
+    :param parse: A callable returning the parsed arguments of a command line, raising JobError if invalid
+    :param run: A callable performing a bisection from parsed arguments and a bisection id and returning its result
+    """
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = _UnixServer(args.socket, _RequestHandler)
+        log.info('Listening on %s', args.socket)
+    else:
+        server = _TCPServer((args.host, args.port), _RequestHandler)
+        log.info('Listening on http://%s:%d', args.host, args.port)
+
+    server.queue = JobQueue(args.workers, parse, run)
+    server.queue.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info('Shutting down')
+    finally:
+        server.queue.stop()
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.unlink(args.socket)
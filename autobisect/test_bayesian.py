@@ -0,0 +1,110 @@
+# coding=utf-8
+# pylint: disable=missing-docstring
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import random
+import time
+
+import pytest
+
+from .bayesian import MAX_JOINT_PROBES
+from .bayesian import Posterior
+
+
+def test_initial_distribution():
+    posterior = Posterior(9, 0.1)
+    assert len(posterior) == 9
+    assert posterior.weights == pytest.approx([0.1] * 10)
+
+
+def test_update_crash_moves_mass_before_probe():
+    posterior = Posterior(9, 0.1)
+    posterior.update(4, True)
+    # The change is at or before the crashing candidate
+    assert sum(posterior.weights[:5]) > 0.95
+    assert sum(posterior.weights) == pytest.approx(1.0)
+
+
+def test_update_pass_moves_mass_after_probe():
+    posterior = Posterior(9, 0.1)
+    posterior.update(4, False)
+    assert sum(posterior.weights[5:]) > 0.85
+    assert sum(posterior.weights) == pytest.approx(1.0)
+
+
+def test_update_find_fix():
+    posterior = Posterior(9, 0.1, find_fix=True)
+    posterior.update(4, False)
+    # A fixed candidate contains the change
+    assert sum(posterior.weights[:5]) > 0.85
+
+
+def test_noisy_pass_is_not_conclusive():
+    posterior = Posterior(9, 0.5)
+    posterior.update(4, False)
+    assert sum(posterior.weights[:5]) > 0.2
+
+
+def test_remove():
+    posterior = Posterior(3, 0.1)
+    posterior.weights = [0.1, 0.2, 0.3, 0.4]
+    posterior.remove(1)
+    assert len(posterior) == 2
+    assert posterior.weights == pytest.approx([0.1, 0.5, 0.4])
+
+
+def test_most_likely():
+    posterior = Posterior(3, 0.1)
+    posterior.weights = [0.1, 0.6, 0.2, 0.1]
+    assert posterior.most_likely() == (1, 0.6)
+
+
+def test_select_empty():
+    assert Posterior(0, 0.1).select(4) == []
+
+
+def test_select_single_probe_splits_distribution():
+    assert Posterior(9, 0.0).select(1) == [4]
+
+
+def test_select_stops_without_gain():
+    posterior = Posterior(9, 0.1)
+    posterior.weights = [0.0] * 10
+    posterior.weights[3] = 1.0
+    assert posterior.select(4) == []
+
+
+def test_select_multiple_probes():
+    probes = Posterior(99, 0.1).select(3)
+    assert len(set(probes)) == 3
+    assert all(0 <= p < 99 for p in probes)
+
+
+@pytest.mark.parametrize('count', [MAX_JOINT_PROBES + 1, 32, 200])
+def test_select_many_probes(count):
+    posterior = Posterior(1000, 0.3)
+    start = time.time()
+    probes = posterior.select(count)
+    assert time.time() - start < 5
+    assert probes == sorted(set(probes))
+    assert 0 < len(probes) <= count
+
+
+@pytest.mark.parametrize('jobs', [1, 4, 16])
+def test_locate_change(jobs):
+    rng = random.Random(1)
+    count, culprit, false_negative = 200, 137, 0.3
+    posterior = Posterior(count, false_negative)
+    for _ in range(200):
+        h, p = posterior.most_likely()
+        if p >= 0.95:
+            break
+        for i in posterior.select(jobs):
+            crashed = i >= culprit and rng.random() >= false_negative
+            posterior.update(i, crashed)
+    assert posterior.most_likely()[0] == culprit
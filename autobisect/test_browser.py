@@ -0,0 +1,39 @@
+# coding=utf-8
+# pylint: disable=missing-docstring
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+from ffpuppet.exceptions import InvalidPrefs
+import pytest
+
+from .evaluator.browser import validate_prefs
+
+
+def test_validate_prefs(tmpdir):
+    prefs = tmpdir.join('prefs.js')
+    prefs.write('// Comment\n'
+                '/* Block\n   comment */\n'
+                'user_pref("browser.startup.page", 0);\n'
+                'user_pref("dom.max_script_run_time", -1);\n'
+                "user_pref('browser.shell.checkDefaultBrowser', false);\n"
+                'user_pref("general.useragent.override", "Mozilla/5.0 (\\"test\\"); // not a comment");\n'
+                'pref("extensions.autoDisableScopes",0);')
+    validate_prefs(str(prefs))
+
+
+@pytest.mark.parametrize('content', [
+    'user_pref("browser.startup.page", 0)\n',
+    'user_pref("browser.startup.page");\n',
+    'user_pref(browser.startup.page, 0);\n',
+    'user_pref("browser.startup.page", 0.5);\n',
+    'user_pref("browser.startup.homepage", "about:blank);\n',
+])
+def test_validate_invalid_prefs(tmpdir, content):
+    prefs = tmpdir.join('prefs.js')
+    prefs.write('user_pref("browser.shell.checkDefaultBrowser", false);\n' + content)
+    with pytest.raises(InvalidPrefs, match='line 2'):
+        validate_prefs(str(prefs))
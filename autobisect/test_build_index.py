@@ -0,0 +1,160 @@
+# coding=utf-8
+# pylint: disable=missing-docstring,redefined-outer-name
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+from datetime import datetime
+from datetime import timedelta
+
+from fuzzfetch import FetcherException
+import pytest
+
+from .build_index import BuildIndex
+from .build_index import StubBackend
+from .build_index import StubBuild
+from .build_manager import DatabaseManager
+
+OLD_DATE = '2018-01-02'
+RECENT_DATE = datetime.utcnow().strftime('%Y-%m-%d')
+
+
+def _build_id(date, hour):
+    return '%s%02d0000' % (date.replace('-', ''), hour)
+
+
+@pytest.fixture
+def backend():
+    return StubBackend([
+        StubBuild(_build_id(OLD_DATE, 12), 'b' * 40),
+        StubBuild(_build_id(OLD_DATE, 3), 'a' * 40),
+        StubBuild(_build_id(RECENT_DATE, 0), 'c' * 40),
+    ])
+
+
+@pytest.fixture
+def db(tmpdir):
+    return DatabaseManager(str(tmpdir.join('autobisect.db')))
+
+
+def _expire(db, date):
+    # Pretend the listing was recorded long ago
+    db.cur.execute('UPDATE build_index SET updated = 0 WHERE date = ?', (date,))
+
+
+def test_get_builds(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    builds = index.get_builds(OLD_DATE)
+    assert [b.changeset for b in builds] == ['a' * 40, 'b' * 40]
+    assert builds[0].build_datetime.hour == 3
+    assert index.get_builds('2018-01-03') == []
+
+
+def test_get_builds_recorded(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    index.get_builds(OLD_DATE)
+    requests = backend.requests
+    builds = BuildIndex(db, backend, 3600).get_builds(OLD_DATE)
+    assert backend.requests == requests
+    assert [b.changeset for b in builds] == ['a' * 40, 'b' * 40]
+
+
+def test_find_build(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    assert index.find_build(OLD_DATE).changeset == 'a' * 40
+    assert index.find_build('2018-01-03') is None
+    # Only the absence of builds is recorded by find_build()
+    requests = backend.requests
+    assert index.find_build('2018-01-03') is None
+    assert index.find_build(OLD_DATE).changeset == 'a' * 40
+    assert backend.requests == requests + 1
+
+
+def test_find_build_after_get_builds(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    index.get_builds(OLD_DATE)
+    requests = backend.requests
+    assert index.find_build(OLD_DATE).changeset == 'a' * 40
+    assert backend.requests == requests
+
+
+def test_listing_failure_not_recorded(db, backend):
+    def fail(date):
+        raise FetcherException('Unable to list %s' % date)
+    index = BuildIndex(db, backend, 3600)
+    iterall, backend.iterall = backend.iterall, fail
+    assert index.get_builds(OLD_DATE) == []
+    assert index.find_build(OLD_DATE) is None
+    backend.iterall = iterall
+    assert len(index.get_builds(OLD_DATE)) == 2
+
+
+def test_unavailable(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    dates = ['2018-01-%02d' % day for day in range(1, 6)]
+    assert index.unavailable(dates) == set()
+    for date in dates:
+        index.find_build(date)
+    assert index.unavailable(dates) == set(dates) - {OLD_DATE}
+
+
+def test_unavailable_many_dates(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    start = datetime(2017, 1, 1)
+    dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(600)]
+    for date in dates:
+        index.find_build(date)
+    assert index.unavailable(dates) == set(dates) - {OLD_DATE}
+
+
+def test_recent_listing_expires(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    assert len(index.get_builds(RECENT_DATE)) == 1
+    backend.builds.append(StubBuild(_build_id(RECENT_DATE, 1), 'd' * 40))
+    assert len(index.get_builds(RECENT_DATE)) == 1
+    _expire(db, RECENT_DATE)
+    assert [b.changeset for b in index.get_builds(RECENT_DATE)] == ['c' * 40, 'd' * 40]
+
+
+def test_immutable_listing_kept(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    assert index.is_immutable(OLD_DATE)
+    assert not index.is_immutable(RECENT_DATE)
+    index.get_builds(OLD_DATE)
+    _expire(db, OLD_DATE)
+    requests = backend.requests
+    assert len(index.get_builds(OLD_DATE)) == 2
+    assert backend.requests == requests
+
+
+def test_empty_listing_expires(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    # The listing may be empty because of a failed request
+    assert index.find_build('2018-01-03') is None
+    assert index.unavailable(['2018-01-03']) == {'2018-01-03'}
+    _expire(db, '2018-01-03')
+    assert index.unavailable(['2018-01-03']) == set()
+    backend.builds.append(StubBuild(_build_id('2018-01-03', 0), 'e' * 40))
+    assert index.find_build('2018-01-03').changeset == 'e' * 40
+
+
+def test_resolve(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    build = index.resolve('b' * 40)
+    assert build.build_id == _build_id(OLD_DATE, 12)
+    assert build.fetcher is backend.builds[1]
+    with pytest.raises(FetcherException):
+        index.resolve('f' * 40)
+
+
+def test_indexed_build_resolves_lazily(db, backend):
+    index = BuildIndex(db, backend, 3600)
+    index.get_builds(OLD_DATE)
+    build = BuildIndex(db, backend, 3600).get_builds(OLD_DATE)[1]
+    requests = backend.requests
+    assert build.fetcher.changeset == 'b' * 40
+    assert backend.requests == requests + 1
+    assert build == index.resolve('b' * 40)
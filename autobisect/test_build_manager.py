@@ -0,0 +1,183 @@
+# coding=utf-8
+# pylint: disable=missing-docstring,redefined-outer-name
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import threading
+
+import pytest
+
+from .build_manager import Build
+from .build_manager import BuildManager
+from .config import BisectionConfig
+
+CONFIG = """
+[autobisect]
+storage-path: %s
+persist: %s
+persist-limit: %d
+eviction-policy: %s
+dedupe: %s
+"""
+
+
+class _Build(object):
+    def __init__(self, changeset):
+        self.changeset = changeset
+
+
+@pytest.fixture
+def make_manager(tmpdir):
+    def make(persist=True, limit=1, policy='lru', dedupe=False):
+        config = tmpdir.join('autobisect.ini')
+        config.write(CONFIG % (tmpdir.join('store'), persist, limit, policy, dedupe))
+        return BuildManager(BisectionConfig(str(config)), 'm-c-linux')
+    return make
+
+
+def _add_build(manager, changeset, size=1024):
+    build = _Build(changeset)
+    path = manager.build_path(build)
+    os.makedirs(path)
+    with open(os.path.join(path, 'firefox'), 'wb') as f:
+        f.write(os.urandom(size))
+    manager.register_build(path)
+    return build
+
+
+def _remove_old_builds(manager):
+    # remove_old_builds() must return even when the limit can't be honoured
+    thread = threading.Thread(target=manager.remove_old_builds)
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_evict_lru(make_manager):
+    manager = make_manager(limit=1)
+    builds = [_add_build(manager, 'a' * 40, 600 * 1024), _add_build(manager, 'b' * 40, 600 * 1024)]
+    manager.record_access(manager.build_path(builds[0]), True)
+    _remove_old_builds(manager)
+    assert os.path.isdir(manager.build_path(builds[0]))
+    assert not os.path.isdir(manager.build_path(builds[1]))
+    assert manager.current_build_size == 600 * 1024
+
+
+def test_evict_without_persist(make_manager):
+    manager = make_manager(persist=False)
+    build = _add_build(manager, 'a' * 40)
+    _remove_old_builds(manager)
+    assert not os.path.isdir(manager.build_path(build))
+    assert manager.current_build_size == 0
+
+
+def test_anchors_exceeding_limit(make_manager):
+    manager = make_manager(persist=False, policy='anchors')
+    anchored = _add_build(manager, 'a' * 40)
+    other = _add_build(manager, 'b' * 40)
+    manager.set_anchors('bisection', [anchored])
+    _remove_old_builds(manager)
+    assert os.path.isdir(manager.build_path(anchored))
+    assert not os.path.isdir(manager.build_path(other))
+
+    manager.set_anchors('bisection', [])
+    _remove_old_builds(manager)
+    assert not os.path.isdir(manager.build_path(anchored))
+
+
+def test_anchors_per_bisection(make_manager):
+    manager = make_manager(persist=False, policy='anchors')
+    first = _add_build(manager, 'a' * 40)
+    second = _add_build(manager, 'b' * 40)
+    manager.set_anchors('first', [first])
+    manager.set_anchors('second', [second])
+    manager.set_anchors('first', [])
+    _remove_old_builds(manager)
+    assert not os.path.isdir(manager.build_path(first))
+    assert os.path.isdir(manager.build_path(second))
+
+
+def test_in_use_exceeding_limit(make_manager):
+    manager = make_manager(persist=False)
+    build = _add_build(manager, 'a' * 40)
+    with manager.get_build(build):
+        _remove_old_builds(manager)
+        assert os.path.isdir(manager.build_path(build))
+    _remove_old_builds(manager)
+    assert not os.path.isdir(manager.build_path(build))
+
+
+def test_sweep_stale_downloads(make_manager):
+    manager = make_manager()
+    work_dir = manager.downloader.work_dir
+    stale = os.path.join(work_dir, 'm-c-linux-%s.0123abcd' % ('a' * 40))
+    os.makedirs(os.path.join(stale, 'firefox'))
+    with open(os.path.join(stale, 'firefox', 'libxul.so'), 'wb') as f:
+        f.write(os.urandom(1024))
+    part = os.path.join(work_dir, 'm-c-linux-%s.tar.bz2.part' % ('a' * 40))
+    with open(part, 'wb') as f:
+        f.write(os.urandom(512))
+    # Downloads in progress are kept
+    active = _Build('b' * 40)
+    manager.acquire_lease('download_queue', manager.build_path(active))
+    manager.db.con.commit()
+    active_part = os.path.join(work_dir, 'm-c-linux-%s.tar.bz2.part' % ('b' * 40))
+    with open(active_part, 'wb') as f:
+        f.write(os.urandom(256))
+    assert manager.current_build_size == 1024 + 512 + 256
+
+    manager.reconcile()
+    assert not os.path.exists(stale)
+    assert not os.path.exists(part)
+    assert os.path.exists(active_part)
+    assert manager.current_build_size == 256
+
+
+def test_dedupe_hardlinks_within_build(make_manager):
+    manager = make_manager(limit=10, dedupe=True)
+    build = _Build('a' * 40)
+    path = manager.build_path(build)
+    os.makedirs(path)
+    with open(os.path.join(path, 'firefox'), 'wb') as f:
+        f.write(os.urandom(1024))
+    os.link(os.path.join(path, 'firefox'), os.path.join(path, 'firefox-bin'))
+    manager.register_build(path)
+    assert manager.current_build_size == 1024
+
+    res = manager.db.cur.execute('SELECT build_path, size, last_access, access_count FROM builds')
+    assert manager.remove_build(Build(*res.fetchone())) == 1024
+    assert manager.current_build_size == 0
+
+
+def test_dedupe_shared_objects(make_manager):
+    manager = make_manager(limit=10, policy='anchors', dedupe=True)
+    content = os.urandom(1024)
+    builds = []
+    for changeset in ('a' * 40, 'b' * 40):
+        build = _Build(changeset)
+        path = manager.build_path(build)
+        os.makedirs(path)
+        with open(os.path.join(path, 'firefox'), 'wb') as f:
+            f.write(content)
+        manager.register_build(path)
+        builds.append(build)
+    assert manager.current_build_size == 1024
+
+    # The object outlives the build which added it
+    manager.set_anchors('bisection', [builds[1]])
+    manager.config.persist_limit = 0
+    _remove_old_builds(manager)
+    assert not os.path.isdir(manager.build_path(builds[0]))
+    assert manager.current_build_size == 1024
+
+    # Objects of builds removed behind the manager's back are collected by reconcile()
+    shutil.rmtree(manager.build_path(builds[1]))
+    manager.reconcile()
+    assert manager.current_build_size == 0
@@ -0,0 +1,381 @@
+# coding=utf-8
+# pylint: disable=missing-docstring,redefined-outer-name
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import configparser
+import io
+import json
+import os
+import platform
+import re
+import stat
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+from . import download
+from .build_index import IndexedBuild
+from .build_index import StubBackend
+from .build_index import StubBuild
+from .download import BuildDownloader
+from .download import DownloadError
+from .download import ExtractionProfile
+from .download import Transfer
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+
+CHANGESET = 'a' * 40
+BUILD_ID = '20180101030000'
+MOZINFO = {'processor': 'x86_64', 'os': 'linux', 'topsrcdir': '/builds/worker/workspace/build/src'}
+
+linux_only = pytest.mark.skipif(platform.system() != 'Linux', reason='Builds are only streamed on Linux')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):  # noqa pylint: disable=invalid-name
+        server = self.server
+        server.requests.append((self.path, self.headers.get('Range')))
+        data = server.files.get(self.path.lstrip('/'))
+        if server.failures:
+            server.failures -= 1
+            self.send_error(500)
+            return
+        if data is None:
+            self.send_error(404)
+            return
+
+        offset = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if match and not server.ignore_range:
+            offset = int(match.group(1))
+            if offset >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (offset, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - offset))
+        self.end_headers()
+
+        body = data[offset:]
+        if server.truncations:
+            # Close the connection part way through the body
+            server.truncations -= 1
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.files = {}
+        self.requests = []
+        self.failures = 0
+        self.truncations = 0
+        self.ignore_range = False
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+@pytest.fixture
+def server():
+    httpd = _Server()
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download, 'BACKOFF_BASE', 0)
+
+
+def _tar_bz2(files):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:bz2') as tar:
+        for name, (data, mode) in sorted(files.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = mode
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zip_fp:
+        for name, (data, mode) in sorted(files.items()):
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFREG | mode) << 16
+            zip_fp.writestr(info, data)
+    return buf.getvalue()
+
+
+def _build(server, target='firefox'):
+    backend = StubBackend([], target=target)
+    return IndexedBuild(BUILD_ID, CHANGESET, backend, StubBuild(BUILD_ID, CHANGESET, server.url))
+
+
+@pytest.fixture
+def firefox(server):
+    server.files['%s.tar.bz2' % CHANGESET] = _tar_bz2({
+        'firefox/firefox': (b'#!/bin/sh\n', 0o755),
+        'firefox/libxul.so': (os.urandom(4096), 0o644),
+        'firefox/browser/omni.ja': (b'omni', 0o644),
+        'README': (b'outside of the build', 0o644),
+    })
+    server.files['%s.crashreporter-symbols.zip' % CHANGESET] = _zip({
+        'libxul.so/0123/libxul.so.sym': (b'MODULE Linux x86_64 0123 libxul.so\n', 0o644),
+    })
+    server.files['%s.mozinfo.json' % CHANGESET] = json.dumps(MOZINFO).encode('utf-8')
+    return _build(server)
+
+
+def _transfer(server, tmpdir, data, retries=2):
+    server.files['artifact'] = data
+    return Transfer('%s/artifact' % server.url, str(tmpdir.join('artifact.part')), retries)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_transfer(server, tmpdir):
+    data = os.urandom(100000)
+    transfer = _transfer(server, tmpdir, data)
+    transfer.run()
+    assert transfer.done and transfer.error is None
+    assert _read(transfer.part_path) == data
+    assert server.requests == [('/artifact', None)]
+
+
+def test_transfer_resume(server, tmpdir):
+    data = os.urandom(100000)
+    transfer = _transfer(server, tmpdir, data)
+    with open(transfer.part_path, 'wb') as f:
+        f.write(data[:30000])
+    transfer.run()
+    assert _read(transfer.part_path) == data
+    assert server.requests == [('/artifact', 'bytes=30000-')]
+
+
+def test_transfer_resume_complete(server, tmpdir):
+    data = os.urandom(1000)
+    transfer = _transfer(server, tmpdir, data)
+    with open(transfer.part_path, 'wb') as f:
+        f.write(data)
+    transfer.run()
+    assert transfer.done
+    assert _read(transfer.part_path) == data
+
+
+def test_transfer_without_range_support(server, tmpdir):
+    data = os.urandom(100000)
+    server.ignore_range = True
+    transfer = _transfer(server, tmpdir, data)
+    with open(transfer.part_path, 'wb') as f:
+        f.write(data[:30000])
+    transfer.run()
+    # The resent head of the artifact is dropped
+    assert _read(transfer.part_path) == data
+
+
+def test_transfer_truncated(server, tmpdir, monkeypatch):
+    # Data is only written once a whole chunk is received
+    monkeypatch.setattr(download, 'CHUNK_SIZE', 1024)
+    data = os.urandom(100000)
+    server.truncations = 2
+    transfer = _transfer(server, tmpdir, data)
+    transfer.run()
+    assert transfer.done and transfer.error is None
+    assert _read(transfer.part_path) == data
+    assert len(server.requests) == 3
+    # Each attempt resumes after the data received so far
+    offsets = [int(r[len('bytes='):-1]) for _, r in server.requests[1:]]
+    assert 0 < offsets[0] <= 50000 < offsets[1]
+
+
+def test_transfer_truncated_without_range_support(server, tmpdir):
+    data = os.urandom(100000)
+    server.truncations = 1
+    server.ignore_range = True
+    transfer = _transfer(server, tmpdir, data)
+    transfer.run()
+    assert _read(transfer.part_path) == data
+
+
+def test_transfer_retries_exhausted(server, tmpdir):
+    server.failures = 10
+    transfer = _transfer(server, tmpdir, b'data', retries=2)
+    transfer.run()
+    assert not transfer.done
+    assert isinstance(transfer.error, DownloadError)
+    assert len(server.requests) == 3
+
+
+def test_transfer_not_found(server, tmpdir):
+    transfer = Transfer('%s/missing' % server.url, str(tmpdir.join('missing.part')), 1)
+    transfer.start()
+    with pytest.raises(DownloadError):
+        transfer.wait()
+
+
+def test_transfer_reader(server, tmpdir):
+    data = os.urandom(3 * download.CHUNK_SIZE)
+    transfer = _transfer(server, tmpdir, data)
+    transfer.start()
+    reader = transfer.reader()
+    try:
+        received = b''.join(iter(lambda: reader.read(65536), b''))
+    finally:
+        reader.close()
+    assert received == data
+
+
+@linux_only
+def test_fetch_firefox(server, tmpdir, firefox):
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 2)
+    target = str(tmpdir.join('build'))
+    downloader.fetch(firefox, target)
+
+    assert sorted(os.listdir(target)) == ['browser', 'dist', 'firefox', 'firefox.fuzzmanagerconf', 'libxul.so',
+                                          'symbols']
+    assert os.stat(os.path.join(target, 'firefox')).st_mode & stat.S_IXUSR
+    assert os.path.isfile(os.path.join(target, 'symbols', 'libxul.so', '0123', 'libxul.so.sym'))
+    assert os.path.realpath(os.path.join(target, 'dist', 'bin')) == os.path.realpath(target)
+    # Partial downloads and extractions are removed
+    assert os.listdir(str(tmpdir.join('tmp'))) == []
+
+    conf = configparser.RawConfigParser()
+    conf.read(os.path.join(target, 'dist', 'bin', 'firefox.fuzzmanagerconf'))
+    assert conf.get('Main', 'platform') == 'x86-64'
+    assert conf.get('Main', 'product') == 'mozilla-central'
+    assert conf.get('Main', 'product_version') == '20180101-aaaaaaaaaaaa'
+    assert conf.get('Main', 'os') == 'linux'
+    assert conf.get('Metadata', 'pathPrefix') == MOZINFO['topsrcdir']
+
+
+@linux_only
+def test_fetch_profile(server, tmpdir, firefox):
+    profile = ExtractionProfile('test', exclude=('symbols/*', 'browser/*'))
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 2, profile)
+    target = str(tmpdir.join('build'))
+    downloader.fetch(firefox, target)
+
+    assert sorted(os.listdir(target)) == ['dist', 'firefox', 'firefox.fuzzmanagerconf', 'libxul.so']
+    # Excluded artifacts aren't downloaded at all
+    assert not any('symbols' in path for path, _ in server.requests)
+
+
+@linux_only
+def test_fetch_js(server, tmpdir):
+    server.files['%s.jsshell.zip' % CHANGESET] = _zip({
+        'js': (b'#!/bin/sh\n', 0o755),
+        'libnspr4.so': (b'library', 0o644),
+    })
+    server.files['%s.crashreporter-symbols.zip' % CHANGESET] = _zip({})
+    server.files['%s.mozinfo.json' % CHANGESET] = json.dumps(MOZINFO).encode('utf-8')
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 2)
+    target = str(tmpdir.join('build'))
+    downloader.fetch(_build(server, 'js'), target)
+
+    assert sorted(os.listdir(target)) == ['dist', 'js', 'js.fuzzmanagerconf', 'libnspr4.so', 'symbols']
+    assert os.stat(os.path.join(target, 'js')).st_mode & stat.S_IXUSR
+
+
+@linux_only
+def test_fetch_truncated_archive(server, tmpdir, firefox):
+    server.truncations = 1
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 2)
+    target = str(tmpdir.join('build'))
+    downloader.fetch(firefox, target)
+    assert os.path.isfile(os.path.join(target, 'libxul.so'))
+
+
+@linux_only
+def test_fetch_failure(server, tmpdir, firefox):
+    symbols = server.files.pop('%s.crashreporter-symbols.zip' % CHANGESET)
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 1)
+    target = str(tmpdir.join('build'))
+    with pytest.raises(DownloadError):
+        downloader.fetch(firefox, target)
+    assert not os.path.exists(target)
+    # Only partial downloads are kept so that a later attempt can resume them
+    assert all(f.endswith('.part') for f in os.listdir(str(tmpdir.join('tmp'))))
+
+    server.files['%s.crashreporter-symbols.zip' % CHANGESET] = symbols
+    downloader.fetch(firefox, target)
+    assert os.path.isdir(os.path.join(target, 'symbols', 'libxul.so'))
+
+
+@linux_only
+def test_fetch_unsafe_member(server, tmpdir, firefox):
+    server.files['%s.tar.bz2' % CHANGESET] = _tar_bz2({
+        'firefox/firefox': (b'#!/bin/sh\n', 0o755),
+        'firefox/../../escaped': (b'data', 0o644),
+    })
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 2)
+    with pytest.raises(DownloadError):
+        downloader.fetch(firefox, str(tmpdir.join('build')))
+    assert not tmpdir.join('escaped').exists()
+
+
+@linux_only
+def test_fetch_corrupt_archive(server, tmpdir, firefox):
+    server.files['%s.tar.bz2' % CHANGESET] = b'BZh9' + os.urandom(1024)
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 2)
+    target = str(tmpdir.join('build'))
+    with pytest.raises(DownloadError):
+        downloader.fetch(firefox, target)
+    # The archive is downloaded again after each failed extraction
+    assert [path for path, _ in server.requests].count('/%s.tar.bz2' % CHANGESET) == 3
+    assert not os.path.exists(target)
+    assert os.listdir(str(tmpdir.join('tmp'))) == []
+
+
+@linux_only
+def test_fetch_corrupt_zip(server, tmpdir, firefox):
+    server.files['%s.crashreporter-symbols.zip' % CHANGESET] = b'PK' + os.urandom(1024)
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 1)
+    with pytest.raises(DownloadError):
+        downloader.fetch(firefox, str(tmpdir.join('build')))
+    assert os.listdir(str(tmpdir.join('tmp'))) == []
+
+
+@linux_only
+def test_fetch_unresolvable_build(server, tmpdir):
+    # The backend lists no build matching the changeset
+    build = IndexedBuild(BUILD_ID, CHANGESET, StubBackend([]))
+    downloader = BuildDownloader(str(tmpdir.join('tmp')), 1)
+    target = str(tmpdir.join('build'))
+    with pytest.raises(DownloadError):
+        downloader.fetch(build, target)
+    assert not os.path.exists(target)
+    assert server.requests == []
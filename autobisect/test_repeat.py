@@ -0,0 +1,47 @@
+# coding=utf-8
+# pylint: disable=missing-docstring
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from .evaluator.repeat import ProcessGroupLauncher
+
+
+def _cancelled_call(_):
+    # Runs in a daemonic pool worker
+    launcher = ProcessGroupLauncher()
+    timer = threading.Timer(0.5, launcher.cancel)
+    timer.start()
+    started = time.time()
+    result = launcher.call(time.sleep, 30)
+    timer.join()
+    return result, time.time() - started, launcher.call(os.getpid)
+
+
+def test_call():
+    launcher = ProcessGroupLauncher()
+    assert launcher.call(os.getpid) != os.getpid()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork()')
+def test_cancel_in_pool_worker():
+    pool = multiprocessing.Pool(1)
+    try:
+        result, elapsed, after = pool.map(_cancelled_call, [None])[0]
+    finally:
+        pool.terminate()
+        pool.join()
+    assert result is None
+    assert elapsed < 10
+    # No further launches once cancelled
+    assert after is None
@@ -44,6 +44,8 @@ if __name__ == '__main__':
               'ffpuppet',
               'fuzzfetch==0.5.7',
               'lithium-reducer',
+              'pytz',
+              'requests',
         ],
         keywords='fuzz fuzzing security test testing bisection',
         license='MPL 2.0',